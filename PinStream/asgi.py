@@ -0,0 +1,413 @@
+"""ASGI entry point: /download streams on the event loop, everything else runs the Flask app.
+
+Serve with, for example:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+A download in flight is a coroutine rather than a worker thread, so one worker
+holds thousands of slow clients. /inspect runs the existing sync pipeline on a
+dedicated thread pool, and every other route goes through the Flask app on a
+second pool, so neither can be starved by downloads.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import httpx
+import requests
+from flask import jsonify
+from werkzeug.datastructures import Headers
+
+import http_client
+from downloads import (DOWNLOAD_BYTES, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_RESPONSES, FORWARDED_REQUEST_HEADERS,
+                       PartSlicer, plan_download, upstream_headers)
+from http_client import DOWNLOAD_TIMEOUT, UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from main import HEADERS, app, download_filename, inspect_url, video_cache, video_prefetcher
+
+# Upstream connections one worker may hold open for downloads
+ASGI_MAX_CONNECTIONS = int(os.environ.get("ASGI_MAX_CONNECTIONS", "2000"))
+# Threads running /inspect, and threads running the other Flask routes
+ASGI_INSPECT_WORKERS = int(os.environ.get("ASGI_INSPECT_WORKERS", "32"))
+ASGI_WSGI_WORKERS = int(os.environ.get("ASGI_WSGI_WORKERS", "16"))
+
+DOWNLOAD_ERROR = 'Failed to download video. The video may be protected or unavailable.'
+
+_client = None
+_inspect_executor = None
+_wsgi_executor = None
+
+
+def get_client():
+    """Return this worker's async HTTP client for video downloads"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASGI_MAX_CONNECTIONS,
+                                max_keepalive_connections=min(ASGI_MAX_CONNECTIONS, 100)),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def send_upstream(method, url, headers, timeout=DOWNLOAD_TIMEOUT):
+    """Send a streamed request with this worker's client, under http_client's upstream policy and metrics.
+
+    Transport errors are raised as their requests counterparts, which is what
+    the policy retries; connect and TLS timings are not recorded here.
+    """
+    client = get_client()
+
+    async def send(timeout):
+        request = client.build_request(method, url, headers=headers, timeout=timeout)
+        started = time.perf_counter()
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        UPSTREAM_SECONDS.labels('ttfb').observe(time.perf_counter() - started)
+        UPSTREAM_REQUESTS.labels(method, str(response.status_code)).inc()
+        return response
+
+    return await http_client.policy.send_async(method, url, timeout, send)
+
+
+def get_executors():
+    global _inspect_executor, _wsgi_executor
+    if _inspect_executor is None:
+        _inspect_executor = ThreadPoolExecutor(max_workers=ASGI_INSPECT_WORKERS, thread_name_prefix='inspect')
+        _wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_WORKERS, thread_name_prefix='wsgi')
+    return _inspect_executor, _wsgi_executor
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/download' and scope['method'] in ('GET', 'HEAD'):
+            await download_video(scope, receive, send)
+        elif scope['path'] == '/inspect' and scope['method'] == 'POST':
+            await inspect_pin(scope, receive, send)
+        else:
+            await run_wsgi(scope, await read_body(receive), send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Created here so a forking server builds them in each worker
+            get_client()
+            get_executors()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _client is not None:
+                await _client.aclose()
+            for executor in (_inspect_executor, _wsgi_executor):
+                if executor is not None:
+                    executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def request_headers(scope):
+    return Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+
+
+async def send_start(send, status, headers, content_type=None):
+    raw_headers = [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+    if content_type:
+        raw_headers.append((b'content-type', content_type.encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+
+
+async def send_json(send, payload, status):
+    """Send payload exactly as the Flask routes' jsonify would"""
+    with app.app_context():
+        response = jsonify(payload)
+    body = response.get_data()
+    await send_start(send, status, {'Content-Length': len(body)}, response.content_type)
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def inspect_pin(scope, receive, send):
+    """Inspect Pinterest pin and return metadata"""
+    body = await read_body(receive)
+    headers = request_headers(scope)
+    try:
+        if headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            raise ValueError('not JSON')
+        data = json.loads(body)
+        url = data['url'] if 'url' in data else ''
+    except (ValueError, TypeError):
+        # Let Flask produce its usual error for a malformed request
+        await run_wsgi(scope, body, send)
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        payload, status = await loop.run_in_executor(get_executors()[0], inspect_url, url)
+    except Exception as e:
+        logging.error("Inspection error: %s", e)
+        payload, status = {'error': str(e)}, 500
+    await send_json(send, payload, status)
+
+
+async def download_video(scope, receive, send):
+    """Stream video file to user"""
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    video_url = query.get('video_url', [''])[0]
+    if not video_url:
+        await send_json(send, {'error': 'Video URL is required'}, 400)
+        return
+    filename = download_filename(query.get('filename', ['pinterest_video.mp4'])[0])
+    method = scope['method']
+    headers = request_headers(scope)
+
+    cached = video_cache.get(video_url)
+    if cached is not None:
+        source_headers = Headers(cached.headers)
+        source_headers['Content-Length'] = str(cached.size)
+        plan = plan_download(200, source_headers, headers, method, filename)
+        DOWNLOAD_RESPONSES.labels('cache', str(plan.status)).inc()
+        await send_start(send, plan.status, plan.headers, plan.content_type)
+        body = None
+        if plan.has_body and method != 'HEAD':
+            body = iter_file(cached.path, plan.parts or [(b'', 0, cached.size)], plan.closing)
+        await send_body(send, receive, body, 'cache')
+        return
+
+    if method == 'GET' and not any(name in headers for name in FORWARDED_REQUEST_HEADERS):
+        prefetched = video_prefetcher.take(video_url)
+        if prefetched is not None:
+            await send_prefetched(send, receive, prefetched, filename, video_url)
+            return
+
+    try:
+        response = await send_upstream(method, video_url, upstream_headers(HEADERS, headers))
+    except (httpx.HTTPError, requests.RequestException) as e:
+        logging.error("Download error: %s", e)
+        await send_json(send, {'error': DOWNLOAD_ERROR}, 500)
+        return
+
+    try:
+        if response.status_code >= 400 and response.status_code != 416:
+            logging.error("Download error: upstream answered %s for %s", response.status_code, video_url)
+            await send_json(send, {'error': DOWNLOAD_ERROR}, 500)
+            return
+
+        plan = plan_download(response.status_code, response.headers, headers, method, filename)
+        DOWNLOAD_RESPONSES.labels('upstream', str(plan.status)).inc()
+        await send_start(send, plan.status, plan.headers, plan.content_type)
+        body = None
+        if plan.has_body and method != 'HEAD':
+            # Undecoded, so the bytes match the upstream Content-Length and ranges
+            body = response.aiter_raw(DOWNLOAD_CHUNK_SIZE)
+            if plan.parts is not None:
+                body = iter_parts(body, plan.parts, plan.closing)
+            elif plan.cacheable and video_cache.enabled and video_cache.can_store(plan.length):
+                writer = video_cache.open_writer(video_url, plan.length, response.headers)
+                if writer is not None:
+                    body = tee(body, writer)
+        await send_body(send, receive, body, 'upstream')
+    finally:
+        await response.aclose()
+
+
+async def send_prefetched(send, receive, prefetched, filename, video_url):
+    """Send a whole video starting with its prefetched bytes"""
+    source_headers = Headers(prefetched.headers)
+    source_headers['Content-Length'] = str(prefetched.length)
+    plan = plan_download(200, source_headers, Headers(), 'GET', filename)
+    DOWNLOAD_RESPONSES.labels('prefetch', str(plan.status)).inc()
+    await send_start(send, plan.status, plan.headers, plan.content_type)
+    body = iter_prefetched(prefetched)
+    if video_cache.enabled and video_cache.can_store(plan.length):
+        writer = video_cache.open_writer(video_url, plan.length, source_headers)
+        if writer is not None:
+            body = tee(body, writer)
+    await send_body(send, receive, body, 'prefetch')
+
+
+async def iter_prefetched(prefetched, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield the prefetched bytes, then the rest of the video from the CDN"""
+    remainder = None
+    if len(prefetched.data) < prefetched.length:
+        # Under way while the prefetched bytes go out
+        remainder = asyncio.ensure_future(send_upstream('GET', prefetched.url, prefetched.remainder_headers()))
+    try:
+        view = memoryview(prefetched.data)
+        for offset in range(0, len(prefetched.data), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+        if remainder is not None:
+            response = await remainder
+            try:
+                prefetched.check_remainder(response.status_code, response.headers)
+                async for chunk in response.aiter_raw(chunk_size):
+                    yield chunk
+            finally:
+                await response.aclose()
+    finally:
+        if remainder is not None and not remainder.done():
+            remainder.cancel()
+        elif remainder is not None and not remainder.cancelled() and remainder.exception() is None:
+            await remainder.result().aclose()
+
+
+async def send_body(send, receive, chunks, source):
+    """Send chunks as the response body, stopping early if the client disconnects"""
+    if chunks is None:
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    counter = DOWNLOAD_BYTES.labels(source)
+    try:
+        async for chunk in chunks:
+            if disconnected.is_set():
+                return
+            # Waits while the client's socket is full, so slow readers apply backpressure
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            counter.inc(len(chunk))
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        await chunks.aclose()
+
+
+async def iter_parts(chunks, parts, closing=b''):
+    """Async counterpart of downloads.iter_parts"""
+    slicer = PartSlicer(parts)
+    async for chunk in chunks:
+        for piece in slicer.feed(chunk):
+            yield piece
+        if slicer.done:
+            break
+    if closing:
+        yield closing
+
+
+async def iter_file(path, parts, closing=b'', chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield byte spans of a file, reading on the default thread pool"""
+    loop = asyncio.get_running_loop()
+    with open(path, 'rb') as f:
+        for prefix, start, stop in parts:
+            if prefix:
+                yield prefix
+            await loop.run_in_executor(None, f.seek, start)
+            remaining = stop - start
+            while remaining > 0:
+                data = await loop.run_in_executor(None, f.read, min(chunk_size, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+    if closing:
+        yield closing
+
+
+async def tee(chunks, writer):
+    """Yield chunks while writing them to the video cache.
+
+    Writes are small sequential appends to local disk, so they run on the loop.
+    """
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+    finally:
+        writer.close()
+
+
+async def run_wsgi(scope, body, send):
+    """Run the Flask app for one request on the WSGI thread pool, streaming its response"""
+    loop = asyncio.get_running_loop()
+    executor = get_executors()[1]
+    environ = wsgi_environ(scope, body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def next_chunk(iterator):
+        return next(iterator, None)
+
+    result = await loop.run_in_executor(executor, app, environ, start_response)
+    iterator = iter(result)
+    try:
+        chunk = await loop.run_in_executor(executor, next_chunk, iterator)
+        await send({
+            'type': 'http.response.start',
+            'status': started['status'],
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in started['headers']],
+        })
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(executor, next_chunk, iterator)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(executor, result.close)
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # ASGI paths are already percent-decoded; WSGI wants their UTF-8 bytes as latin-1
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
@@ -0,0 +1 @@
+"""Offline benchmarks for PinStream; run from the PinStream directory with python -m benchmarks.<name>"""
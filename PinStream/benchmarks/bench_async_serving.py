@@ -0,0 +1,140 @@
+"""Compare concurrent /download capacity of the gunicorn sync setup and the ASGI mode.
+
+Slow clients each read the first bytes of a large video from a stub CDN and
+then stall, holding their download open. The report shows how many of them
+got their download started, and how long the index page takes meanwhile.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_async_serving [--clients 200] [--workers 1] [--video-mb 16] [--hold 8]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.stub_server import StubServer
+
+# Bytes a client reads before it stalls, and its small receive buffer, so
+# stalled clients push back on the server instead of soaking up the video
+FIRST_BYTES = 64 * 1024
+CLIENT_RCVBUF = 64 * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workers):
+    if mode == 'gunicorn sync':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                   '--bind', f'127.0.0.1:{port}', 'main:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def open_client(port):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_RCVBUF)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock)
+
+
+async def slow_download(port, path, timeout, hold_until):
+    """Return seconds until FIRST_BYTES of the response arrived, or None on timeout"""
+    started = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(open_client(port), timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+        received = 0
+        while received < FIRST_BYTES:
+            remaining = timeout - (time.perf_counter() - started)
+            chunk = await asyncio.wait_for(reader.read(FIRST_BYTES), max(remaining, 0.001))
+            if not chunk:
+                return None
+            received += len(chunk)
+        elapsed = time.perf_counter() - started
+        # Stall with the download open, like a paused or very slow player
+        await asyncio.sleep(max(hold_until - time.monotonic(), 0))
+        return elapsed
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def fetch_page(port, timeout):
+    """Return seconds to fetch the index page, or None on timeout"""
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+        writer.write(b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n')
+        await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        return time.perf_counter() - started
+    except (asyncio.TimeoutError, OSError):
+        return None
+
+
+async def load(port, path, clients, timeout, hold):
+    hold_until = time.monotonic() + hold
+    downloads = [asyncio.create_task(slow_download(port, path, timeout, hold_until)) for _ in range(clients)]
+    # Probe once the downloads are under way
+    await asyncio.sleep(min(1.0, hold / 2))
+    page = await fetch_page(port, timeout)
+    return await asyncio.gather(*downloads), page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=1, help='server worker processes for both modes')
+    parser.add_argument('--video-mb', type=float, default=16)
+    parser.add_argument('--hold', type=float, default=8, help='seconds each client keeps its download open')
+    parser.add_argument('--timeout', type=float, default=5, help='seconds a client waits for its first bytes')
+    args = parser.parse_args()
+
+    video = os.urandom(int(args.video_mb * 1024 * 1024))
+    print(f"{args.clients} stalled clients, {args.video_mb:g} MB video, {args.workers} worker(s), "
+          f"{args.timeout:g} s start timeout")
+    print(f"{'mode':<16}{'started':>10}{'p50 ms':>10}{'p95 ms':>10}{'index page ms':>16}")
+    with StubServer() as cdn:
+        cdn.add_route('/video.mp4', video, content_type='video/mp4')
+        path = f'/download?video_url={cdn.base_url}/video.mp4'
+        for mode in ('gunicorn sync', 'uvicorn asgi'):
+            port = free_port()
+            process = start_server(mode, port, args.workers)
+            try:
+                results, page = asyncio.run(load(port, path, args.clients, args.timeout, args.hold))
+            finally:
+                process.terminate()
+                process.wait()
+            times = sorted(result * 1000 for result in results if result is not None)
+            p50 = f"{statistics.median(times):.0f}" if times else '-'
+            p95 = f"{times[int(len(times) * 0.95) - 1 if len(times) > 1 else 0]:.0f}" if times else '-'
+            page = f"{page * 1000:.0f}" if page is not None else 'timeout'
+            print(f"{mode:<16}{len(times):>10}{p50:>10}{p95:>10}{page:>16}")
+
+
+if __name__ == '__main__':
+    main()
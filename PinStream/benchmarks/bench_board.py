@@ -0,0 +1,83 @@
+"""Compare peak memory and throughput of board inspections, streamed through bounded queues or listed up front.
+
+The stub serves a board of copies of the recorded pin pages through the
+resource API. 'stream' is the /inspect/board pipeline; 'eager' lists the
+whole board first and hands it to the /inspect/batch pool. Every board
+size runs in its own process, so its peak RSS is its own.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_board [--sizes 250 1000 4000] [--concurrency 8] [--latency 0.005]
+"""
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_suite import peak_rss_mb
+from benchmarks.corpus import BOARD_SLUG, BOARD_USERNAME, load_cases, serve_board
+from benchmarks.stub_server import StubServer
+
+
+def run_child(args):
+    # Imported here so every child process pays for the app's imports itself
+    import main
+    from board_listing import Collection, PinLister
+    logging.getLogger().setLevel(logging.WARNING)
+
+    def inspect(url):
+        return {'success': True, 'metadata': main.extract_pinterest_metadata(url, use_cache=False)}, 200
+
+    collection = Collection('board', args.base_url, BOARD_USERNAME, BOARD_SLUG)
+    pin_urls = PinLister(headers=main.HEADERS, max_pins=args.child_size).iter_pins(collection)
+    started = time.perf_counter()
+    if args.child == 'stream':
+        lines = main.stream_collection_inspections(pin_urls, args.concurrency, inspect=inspect)
+    else:
+        main.inspect_url = inspect
+        lines = main.stream_inspections(list(pin_urls), args.concurrency)
+    pins = videos = 0
+    for line in lines:
+        result = json.loads(line)
+        pins += 1
+        videos += bool(result.get('metadata', {}).get('video_url'))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'pins': pins, 'videos': videos, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 1000, 4000])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.005, help='stub response delay in seconds')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"Boards of {', '.join(map(str, args.sizes))} pins, {args.concurrency} inspectors, "
+          f"{args.latency * 1000:.1f} ms stub latency")
+    print(f"{'mode':<8}{'pins':>7}{'videos':>8}{'seconds':>9}{'pins/s':>8}{'peak MB':>9}")
+    with StubServer(latency=args.latency) as server:
+        serve_board(server, load_cases(), max(args.sizes))
+        for size in args.sizes:
+            for mode in ('stream', 'eager'):
+                child = subprocess.run([sys.executable, '-m', 'benchmarks.bench_board', '--child', mode,
+                                        '--child-size', str(size), '--base-url', server.base_url,
+                                        '--concurrency', str(args.concurrency)], capture_output=True, text=True)
+                if child.returncode != 0:
+                    print(f"{mode:<8}{size:>7}  failed:\n{child.stderr}")
+                    continue
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                print(f"{mode:<8}{result['pins']:>7}{result['videos']:>8}{result['seconds']:>9.2f}"
+                      f"{result['pins'] / result['seconds']:>8.0f}{result['peak_rss_mb']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
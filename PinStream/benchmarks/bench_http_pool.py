@@ -0,0 +1,55 @@
+"""Compare fresh requests.get calls with the shared pooled session layer.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_http_pool [--requests 200] [--threads 8] [--latency 0.002] [--connect-latency 0.03]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+from benchmarks.stub_server import StubServer
+
+PAGE = '<html><head><meta property="og:title" content="Stub pin"></head></html>' * 200
+
+
+def run(server, fetch, total, threads):
+    """Fetch the stub page total times over threads; return (seconds, connections)"""
+    url = server.base_url + '/pin/1/'
+    server.reset_counters()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for response in pool.map(lambda _: fetch(url), range(total)):
+            response.raise_for_status()
+    return time.perf_counter() - started, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.002, help='stub response delay in seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.03,
+                        help='delay per new connection, standing in for TCP + TLS handshakes')
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+        server.add_route('/pin/1/', PAGE)
+        modes = [
+            ('requests.get', lambda url: requests.get(url, timeout=10)),
+            ('http_client.get', lambda url: http_client.get(url, timeout=10)),
+        ]
+        print(f"{args.requests} GETs over {args.threads} threads, {args.latency * 1000:.1f} ms stub latency, "
+              f"{args.connect_latency * 1000:.1f} ms per new connection")
+        print(f"{'mode':<18}{'seconds':>10}{'req/s':>10}{'connections':>14}")
+        for name, fetch in modes:
+            elapsed, connections = run(server, fetch, args.requests, args.threads)
+            print(f"{name:<18}{elapsed:>10.3f}{args.requests / elapsed:>10.0f}{connections:>14}")
+        print("pools:", http_client.pool_stats())
+
+
+if __name__ == '__main__':
+    main()
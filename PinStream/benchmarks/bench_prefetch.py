@@ -0,0 +1,68 @@
+"""Compare /download time to first byte with and without the inspect-time video prefetch.
+
+Each round starts the prefetch a successful /inspect would start, waits a
+user's think time, then downloads the video through the Flask app.
+The stub CDN adds a fixed delay to every response, standing in for the
+CDN's time to first byte.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_prefetch [--rounds 30] [--latency 0.05] [--think 0.3] [--video-mb 4]
+"""
+import argparse
+import logging
+import statistics
+import time
+
+import main as web
+from benchmarks.stub_server import StubServer
+from video_prefetch import VideoPrefetcher
+
+
+def download(client, url):
+    """Return (seconds to the first body chunk, seconds to the last) for one download"""
+    started = time.perf_counter()
+    response = client.get('/download', query_string={'video_url': url}, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    first = time.perf_counter() - started
+    for _ in chunks:
+        pass
+    response.close()
+    return first, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub CDN response delay in seconds')
+    parser.add_argument('--think', type=float, default=0.3, help='seconds between inspect and download')
+    parser.add_argument('--video-mb', type=float, default=4)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = web.app.test_client()
+    print(f"{args.rounds} downloads per mode, {args.latency * 1000:.0f} ms CDN latency, "
+          f"{args.think * 1000:.0f} ms think time, {args.video_mb:g} MB videos")
+    print(f"{'mode':<12}{'ttfb p50':>10}{'ttfb p95':>10}{'total p50':>11}   prefetch stats")
+    with StubServer(latency=args.latency) as cdn:
+        for round_ in range(args.rounds):
+            cdn.add_video(f'/videos/{round_}.mp4', int(args.video_mb * 1024 * 1024), etag=f'"{round_}"')
+        for mode in ('off', 'prefetch'):
+            web.video_prefetcher = VideoPrefetcher(headers=web.HEADERS, enabled=mode == 'prefetch')
+            firsts, totals = [], []
+            for round_ in range(args.rounds):
+                url = f'{cdn.base_url}/videos/{round_}.mp4'
+                web.video_prefetcher.schedule(url)
+                time.sleep(args.think)
+                first, total = download(client, url)
+                firsts.append(first * 1000)
+                totals.append(total * 1000)
+            firsts.sort()
+            stats = web.video_prefetcher.stats()
+            print(f"{mode:<12}{statistics.median(firsts):>10.1f}{firsts[int(len(firsts) * 0.95) - 1]:>10.1f}"
+                  f"{statistics.median(totals):>11.1f}   hits {stats['hits']}, misses {stats['misses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Measure worker startup: import time and memory of the app, and per-worker memory with and without preloading.
+
+Every measurement runs in a fresh interpreter. 'import' rows time `import
+main` and what loading the parsers and the trafilatura fallback adds on top.
+'workers' rows fork --workers processes and time each until it has parsed
+a recorded pin page, either after the parent ran main.create_app()
+(gunicorn --preload) or with every worker importing the app itself, and
+report the memory private to each worker (Linux only, from
+/proc/<pid>/smaps_rollup).
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_startup [--runs 5] [--workers 4]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import FIXTURE_DIR
+
+IMPORT_STEPS = [
+    ('main', 'import main'),
+    ('+ parsers', 'main.preload_parsers()'),
+    ('+ trafilatura', 'import trafilatura'),
+]
+
+
+def memory_mb():
+    """Return (rss, private) of this process in MB; private is None without smaps_rollup"""
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024), None
+    return fields['Rss'], fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+
+
+def run_import_child(steps):
+    """Run the import steps one after another, reporting the time and RSS after each"""
+    results = []
+    for name, statement in IMPORT_STEPS[:steps]:
+        started = time.perf_counter()
+        exec(statement, globals())
+        results.append({'step': name, 'seconds': time.perf_counter() - started, 'rss_mb': memory_mb()[0]})
+    print(json.dumps(results))
+
+
+def first_inspection():
+    """Parse a recorded pin page the way the first inspection in a worker does"""
+    import main
+    with open(os.path.join(FIXTURE_DIR, 'video_pin_state.html'), encoding='utf-8') as f:
+        page = f.read()
+    document = main.PageDocument(page, page)
+    document.meta_soup
+    document.soup
+
+
+def run_workers_child(workers, preload):
+    """Fork workers like gunicorn, with or without the app loaded first; report each worker's memory"""
+    if preload:
+        import main
+        main.create_app()
+    pipes = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        if os.fork() == 0:
+            os.close(read_end)
+            started = time.perf_counter()
+            first_inspection()
+            seconds = time.perf_counter() - started
+            rss, private = memory_mb()
+            os.write(write_end, json.dumps({'seconds': seconds, 'rss_mb': rss, 'private_mb': private}).encode())
+            # Stay alive until every worker measured itself, so shared pages stay shared
+            time.sleep(1)
+            os._exit(0)
+        os.close(write_end)
+        pipes.append(read_end)
+    results = []
+    for read_end in pipes:
+        with os.fdopen(read_end) as f:
+            results.append(json.loads(f.read()))
+    for _ in pipes:
+        os.wait()
+    print(json.dumps(results))
+
+
+def child(*args):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child', *args],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per import measurement')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child[0] == 'import':
+            run_import_child(int(args.child[1]))
+        else:
+            run_workers_child(int(args.child[1]), args.child[0] == 'preload')
+        return
+
+    runs = [child('import', str(len(IMPORT_STEPS))) for _ in range(args.runs)]
+    print(f"Imports, median of {args.runs} fresh interpreters")
+    print(f"{'step':<16}{'ms':>8}{'total ms':>10}{'RSS MB':>9}")
+    total = 0.0
+    for index, (name, _) in enumerate(IMPORT_STEPS):
+        seconds = statistics.median(run[index]['seconds'] for run in runs)
+        total += seconds
+        print(f"{name:<16}{seconds * 1000:>8.1f}{total * 1000:>10.1f}"
+              f"{statistics.median(run[index]['rss_mb'] for run in runs):>9.1f}")
+
+    print(f"\n{args.workers} forked workers, each parsing one pin page")
+    print(f"{'mode':<16}{'ready ms':>15}{'RSS MB':>9}{'private MB':>12}")
+    for mode in ('preload', 'per-worker'):
+        workers = child(mode, str(args.workers))
+        private = [worker['private_mb'] for worker in workers]
+        print(f"{mode:<16}{statistics.median(w['seconds'] for w in workers) * 1000:>15.1f}"
+              f"{statistics.median(w['rss_mb'] for w in workers):>9.1f}"
+              f"{statistics.median(private) if None not in private else float('nan'):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Offline latency, throughput and memory benchmarks for inspection, detection and downloads.
+
+The fixture corpus is served by a local stub with configurable latency. Each
+benchmark runs in its own process, so its peak RSS is its own, and reports
+p50/p95/p99 latency, throughput and peak RSS. Results can be saved as JSON
+and compared with a run from another commit; the exit status is non-zero
+when a benchmark got slower than --threshold or a detection result changed.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_suite [--iterations 30] [--latency 0.01] [--only extract]
+                                     [--output results.json] [--baseline previous.json]
+
+Feature flags are read from the environment as usual, so two configurations
+can be compared the same way, e.g. SEGMENTED_DOWNLOAD=true.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import VIDEO_PATH, case_url, load_cases, serve_corpus, stub_short_link_resolver
+from benchmarks.stub_server import StubServer
+
+DETECTION_METHODS = [
+    'structured_data', 'api_calls', 'elements', 'internal_data', 'mobile',
+    'og_tags', 'script_tags', 'video_containers', 'cdn_patterns', 'trafilatura', 'alternative',
+]
+
+# Range of a player's first request for a video
+FIRST_RANGE = 'bytes=0-1048575'
+
+
+def benchmark_names(cases):
+    return ([f'extract:{case.name}' for case in cases] + ['parse:soup']
+            + [f'detect:{method}' for method in DETECTION_METHODS] + ['download:full', 'download:range'])
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(run, iterations, warmup):
+    """Call run() warmup + iterations times; return the timed samples in seconds"""
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def prepare(name, base_url, cases):
+    """Return (run, check) for one benchmark; check() counts wrong detection results"""
+    # Imported here so every child process pays for the app's imports itself
+    import main
+    from html_document import PageDocument
+    from video_scanner import PAGE_SCANNER
+
+    kind, _, target = name.partition(':')
+    results = []
+
+    def check():
+        return sum(1 for expected, found in results if expected != found)
+
+    if kind == 'extract':
+        case = next(case for case in cases if case.name == target)
+        url = case_url(base_url, case)
+        # Short links go through the resolver, with the stub standing in for pin.it
+        main.short_link_resolver = stub_short_link_resolver(base_url, main.HEADERS)
+
+        def run():
+            metadata = main.extract_pinterest_metadata(url, use_cache=False)
+            results.append((case.video_url, metadata['video_url']))
+        return run, check
+
+    if kind == 'download':
+        client = main.app.test_client()
+        path = f'/download?video_url={base_url}{VIDEO_PATH}'
+        headers = {'Range': FIRST_RANGE} if target == 'range' else {}
+
+        def run():
+            response = client.get(path, headers=headers)
+            results.append((206 if target == 'range' else 200, response.status_code))
+            results.append((True, len(response.get_data()) > 0))
+        return run, check
+
+    # Parsing and detection run against pages fetched once, outside the timing
+    pages = []
+    for case in cases:
+        if case.page is None:
+            continue
+        response = main.fetch_pin_page(case_url(base_url, case))
+        pages.append((case, case_url(base_url, case), response.content, response.text))
+    if kind == 'parse':
+        def run():
+            for _, _, content, text in pages:
+                PageDocument(content, text).soup
+        return run, check
+
+    soups = [PageDocument(content, text).soup for _, _, content, text in pages]
+    find = {
+        'structured_data': lambda url, text, soup, pin_id: main.find_video_in_structured_data(soup),
+        'api_calls': lambda url, text, soup, pin_id: main.find_video_in_api_calls(text, pin_id),
+        'elements': lambda url, text, soup, pin_id: main.find_video_in_elements(soup),
+        'internal_data': lambda url, text, soup, pin_id: main.find_video_in_internal_data(text, pin_id),
+        'mobile': lambda url, text, soup, pin_id: main.try_mobile_extraction(url),
+        'og_tags': lambda url, text, soup, pin_id: main.find_video_in_og_tags(soup),
+        'script_tags': lambda url, text, soup, pin_id: main.find_video_in_script_tags(soup),
+        'video_containers': lambda url, text, soup, pin_id: main.find_video_in_containers(soup),
+        'cdn_patterns': lambda url, text, soup, pin_id: main.find_video_in_cdn_patterns(
+            text, url, pin_id, PAGE_SCANNER.scan(text, pin_id)),
+        'trafilatura': lambda url, text, soup, pin_id: main.find_video_with_trafilatura(text),
+        'alternative': lambda url, text, soup, pin_id: main.try_alternative_video_extraction(url),
+    }[target]
+
+    def run():
+        # One sample is one pass over every page, hits and misses alike
+        for (case, url, _, text), soup in zip(pages, soups):
+            find(url, text, soup, case.pin_id)
+    return run, check
+
+
+def run_child(args):
+    """Run one benchmark in this process and print its result as JSON"""
+    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+    cases = load_cases(args.huge_mb)
+    run, check = prepare(args.child, args.base_url, cases)
+    samples = sorted(measure(run, args.iterations, args.warmup))
+    result = {
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'ops_per_s': len(samples) / sum(samples),
+        'peak_rss_mb': peak_rss_mb(),
+        'mismatches': check(),
+    }
+    if args.child.startswith('download:'):
+        size = 1024 ** 2 if args.child == 'download:range' else args.video_mb * 1024 ** 2
+        result['mb_per_s'] = size / 1024 ** 2 * result['ops_per_s']
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a baseline run; return the names that regressed"""
+    regressed = []
+    print(f"\nagainst {baseline.get('commit') or 'baseline'}:")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSED'
+            regressed.append(name)
+        print(f"{name:<28}{before['p50_ms']:>10.2f} -> {result['p50_ms']:>8.2f} ms {change:>+8.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.01, help='stub response delay in seconds')
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help='delay per new connection, standing in for TCP + TLS handshakes')
+    parser.add_argument('--huge-mb', type=float, default=4, help='size of the huge pin page')
+    parser.add_argument('--video-mb', type=float, default=8, help='size of the stub video')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run only benchmarks whose name starts with this; repeatable')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved by --output')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='p50 slowdown against the baseline that counts as a regression')
+    parser.add_argument('--log-level', default='warning')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    cases = load_cases(args.huge_mb)
+    names = [name for name in benchmark_names(cases)
+             if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+    settings = {name: getattr(args, name) for name in
+                ('iterations', 'warmup', 'latency', 'connect_latency', 'huge_mb', 'video_mb')}
+    print(f"{len(names)} benchmarks, {args.iterations} iterations each, {args.latency * 1000:.1f} ms stub latency")
+    print(f"{'benchmark':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak MB':>10}")
+
+    results = {}
+    failed = []
+    with StubServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+        serve_corpus(server, cases, args.video_mb)
+        for name in names:
+            command = [sys.executable, '-m', 'benchmarks.bench_suite', '--child', name,
+                       '--base-url', server.base_url, '--log-level', args.log_level]
+            for setting, value in settings.items():
+                command += [f"--{setting.replace('_', '-')}", str(value)]
+            child = subprocess.run(command, capture_output=True, text=True)
+            if child.returncode != 0:
+                print(f"{name:<28}failed:\n{child.stderr}")
+                failed.append(name)
+                continue
+            result = results[name] = json.loads(child.stdout.strip().splitlines()[-1])
+            note = f"  {result['mismatches']} wrong results" if result['mismatches'] else ''
+            if 'mb_per_s' in result:
+                note = f"  {result['mb_per_s']:.0f} MB/s" + note
+            print(f"{name:<28}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                  f"{result['ops_per_s']:>10.1f}{result['peak_rss_mb']:>10.1f}{note}")
+            if result['mismatches']:
+                failed.append(name)
+
+    run = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': settings,
+        'flags': {name: value for name, value in os.environ.items()
+                  if name in ('HEDGED_FETCH', 'STREAMING_FETCH', 'SEGMENTED_DOWNLOAD', 'ADAPTIVE_DETECTION',
+                              'VIDEO_CACHE_DIR')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print("warning: the baseline was run with different settings; timings are not comparable")
+        failed += compare(results, baseline, args.threshold)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
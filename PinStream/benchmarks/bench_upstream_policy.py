@@ -0,0 +1,91 @@
+"""Compare upstream fetches with and without the per-host upstream policy against a throttling, stalling stub.
+
+The stub answers 429 beyond --rate-limit requests per second and holds a
+share of the rest for --stall seconds, like pinterest.com under load.
+Each fault is tried alone and then both together; every mode makes the
+same fetches over the same threads, and a fetch counts as ok only if it
+ended in a 200.
+
+Run from the PinStream directory:
+
+    python -m benchmarks.bench_upstream_policy [--requests 300] [--threads 16] [--rate-limit 50]
+                                               [--stall-ratio 0.01] [--stall 4] [--timeout 10]
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+from benchmarks.stub_server import StubServer
+from upstream_policy import UpstreamPolicy, UpstreamUnavailable
+
+PAGE = '<html><head><meta property="og:title" content="Stub pin"></head></html>' * 200
+
+
+def fetch(url, timeout):
+    """Return (outcome, seconds) for one GET"""
+    started = time.perf_counter()
+    try:
+        response = http_client.get(url, timeout=timeout)
+        outcome = 'ok' if response.status_code == 200 else str(response.status_code)
+    except UpstreamUnavailable:
+        outcome = 'refused'
+    except requests.Timeout:
+        outcome = 'timeout'
+    except requests.RequestException:
+        outcome = 'error'
+    return outcome, time.perf_counter() - started
+
+
+def run(server, total, threads, timeout):
+    """Fetch the stub page total times over threads; return (seconds, outcomes, latencies)"""
+    url = server.base_url + '/pin/1/'
+    server.reset_counters()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: fetch(url, timeout), range(total)))
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return time.perf_counter() - started, outcomes, sorted(seconds for _, seconds in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.01, help='stub response delay in seconds')
+    parser.add_argument('--rate-limit', type=int, default=50, help='requests per second the stub answers')
+    parser.add_argument('--stall-ratio', type=float, default=0.01, help='share of requests the stub stalls')
+    parser.add_argument('--stall', type=float, default=4, help='seconds a stalled request is held')
+    parser.add_argument('--timeout', type=float, default=10, help='timeout the callers ask for')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    scenarios = [
+        ('429s', {'rate_limit': args.rate_limit}),
+        ('stalls', {'stall_ratio': args.stall_ratio, 'stall': args.stall}),
+        ('both', {'rate_limit': args.rate_limit, 'stall_ratio': args.stall_ratio, 'stall': args.stall}),
+    ]
+    print(f"{args.requests} GETs over {args.threads} threads; stub allows {args.rate_limit} req/s, "
+          f"stalls {args.stall_ratio:.1%} for {args.stall:g} s; callers' timeout {args.timeout:g} s")
+    print(f"{'stub':<8}{'mode':<8}{'seconds':>9}{'ok':>6}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'upstream':>10}"
+          f"{'429s':>6}   other outcomes")
+    for scenario, faults in scenarios:
+        with StubServer(latency=args.latency, **faults) as server:
+            server.add_route('/pin/1/', PAGE)
+            for mode in ('off', 'policy'):
+                http_client.policy = UpstreamPolicy(
+                    enabled=mode == 'policy', rate=args.rate_limit * 0.9, burst=args.rate_limit * 0.5,
+                    max_wait=args.timeout, timeout_min=0.25, timeout_samples=10)
+                elapsed, outcomes, latencies = run(server, args.requests, args.threads, args.timeout)
+                ok = outcomes.pop('ok', 0)
+                print(f"{scenario:<8}{mode:<8}{elapsed:>9.2f}{ok:>6}{latencies[len(latencies) // 2] * 1000:>9.0f}"
+                      f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>9.0f}{latencies[-1] * 1000:>9.0f}"
+                      f"{server.requests:>10}{server.throttled_requests:>6}   {outcomes or '-'}")
+
+if __name__ == '__main__':
+    main()
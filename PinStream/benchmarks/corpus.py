@@ -0,0 +1,138 @@
+"""Pin page fixtures and stub videos served by the stub server, so benchmarks never touch Pinterest.
+
+Recorded pages live in benchmarks/fixtures with their expected video URL in
+pins.json; drop in another saved pin page and add an entry to extend the
+corpus. Two cases are derived from the recordings: a short link, resolved
+by ShortLinkResolver with the stub standing in for pin.it, and a page padded with a server-rendered related-pins grid. serve_board()
+lists copies of the recordings as the pins of a board of any size.
+"""
+import json
+import os
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import short_links
+from short_links import ShortLinkResolver
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Recorded page padded into the huge-page case, and where the padding goes
+HUGE_PAGE_BASE = 'video_pin_state'
+HUGE_PAGE_MARKER = '<script id="__PWS_DATA__"'
+
+SHORT_LINK_TARGET = 'video_pin_state'
+SHORT_LINK_PATH = '/3xAmPle'
+# The stub answers short links under this name and pin pages under 127.0.0.1,
+# like pin.it and www.pinterest.com
+SHORT_LINK_HOST = 'localhost'
+
+VIDEO_PATH = '/videos/mc/720p/stub.mp4'
+
+# Board served by serve_board(), and the ID of its first pin
+BOARD_USERNAME = 'stub'
+BOARD_SLUG = 'stub-board'
+BOARD_ID = '549755813888'
+BOARD_FIRST_PIN_ID = 900000000000000000
+
+PinCase = namedtuple('PinCase', ['name', 'path', 'pin_id', 'video_url', 'page'])
+
+
+def related_pins_grid(size):
+    """Return about size bytes of related-pin grid markup"""
+    items = []
+    total = 0
+    index = 0
+    while total < size:
+        item = (f'<div data-test-id="pin" data-grid-item="true" style="top:{index * 13 % 4000}px">'
+                f'<a href="/pin/{10 ** 17 + index}/" aria-label="Related pin {index}">'
+                f'<img alt="Related pin {index}" src="https://i.pinimg.com/236x/{index % 256:02x}/'
+                f'{index * 7 % 256:02x}/{index * 13 % 256:02x}/related{index}.jpg" loading="lazy"/></a>'
+                f'<div class="grid-title">Saved idea {index}</div></div>')
+        items.append(item)
+        total += len(item)
+        index += 1
+    return '<div data-test-id="related-pins">' + ''.join(items) + '</div>'
+
+
+def load_cases(huge_mb=4.0):
+    """Return the corpus as PinCases, paths relative to the stub server"""
+    with open(os.path.join(FIXTURE_DIR, 'pins.json')) as f:
+        entries = json.load(f)
+
+    cases = []
+    for entry in entries:
+        with open(os.path.join(FIXTURE_DIR, entry['file']), encoding='utf-8') as f:
+            page = f.read()
+        cases.append(PinCase(entry['name'], f"/pin/{entry['pin_id']}/", entry['pin_id'], entry['video_url'], page))
+    recorded = {case.name: case for case in cases}
+
+    target = recorded[SHORT_LINK_TARGET]
+    cases.append(target._replace(name='short_link', path=SHORT_LINK_PATH, page=None))
+
+    base = recorded[HUGE_PAGE_BASE]
+    padding = related_pins_grid(int(huge_mb * 1024 * 1024) - len(base.page))
+    huge_pin_id = str(int(base.pin_id) + 1)
+    page = base.page.replace(HUGE_PAGE_MARKER, padding + HUGE_PAGE_MARKER, 1).replace(base.pin_id, huge_pin_id)
+    cases.append(PinCase('huge_page', f'/pin/{huge_pin_id}/', huge_pin_id, base.video_url, page))
+    return cases
+
+
+def case_url(base_url, case):
+    """Return the URL a case is inspected at; the short link is on the stub's short-link host"""
+    if case.name == 'short_link':
+        return base_url.replace('127.0.0.1', SHORT_LINK_HOST, 1) + case.path
+    return base_url + case.path
+
+
+def stub_short_link_resolver(base_url, headers=None):
+    """Treat the stub's short-link host as pin.it and return a resolver leading back to the stub.
+
+    It caches nothing, so every inspection of the short link pays for resolving it.
+    """
+    short_links.SHORT_LINK_HOSTS.add(urlsplit(base_url).netloc.replace('127.0.0.1', SHORT_LINK_HOST, 1))
+    return ShortLinkResolver(headers=headers, maxsize=0, origin=base_url)
+
+
+def serve_corpus(server, cases, video_mb=8.0):
+    """Register every case and a stub video on server"""
+    for case in cases:
+        if case.page is None:
+            server.add_redirect(case.path, f'/pin/{case.pin_id}/')
+        else:
+            server.add_route(case.path, case.page)
+    server.add_video(VIDEO_PATH, int(video_mb * 1024 * 1024))
+
+
+def serve_board(server, cases, size):
+    """Serve a board of size pins through the resource API, pin i a copy of recorded case i % len
+
+    Returns a function giving the expected video URL of a pin ID. Pin pages are made
+    on request, so a board of any size costs the stub no memory.
+    """
+    recorded = [case for case in cases if case.page is not None and case.name != 'huge_page']
+    json_response = {'Content-Type': 'application/json'}
+
+    def resource(target):
+        query = parse_qs(urlsplit(target).query)
+        options = json.loads(query['data'][0])['options']
+        if '/BoardResource/' in target:
+            data, bookmark = {'id': BOARD_ID, 'pin_count': size}, None
+        else:
+            start = int((options.get('bookmarks') or ['0'])[0])
+            stop = min(start + options.get('page_size', 25), size)
+            data = [{'type': 'pin', 'id': str(BOARD_FIRST_PIN_ID + index)} for index in range(start, stop)]
+            bookmark = str(stop) if stop < size else '-end-'
+        body = json.dumps({'resource_response': {'data': data, 'bookmark': bookmark}}).encode()
+        return 200, json_response, body
+
+    def pin_page(target):
+        pin_id = urlsplit(target).path.strip('/').split('/')[-1]
+        index = int(pin_id) - BOARD_FIRST_PIN_ID if pin_id.isdigit() else -1
+        if not 0 <= index < size:
+            return None
+        case = recorded[index % len(recorded)]
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, case.page.replace(case.pin_id, pin_id).encode()
+
+    server.add_handler('/resource/', resource)
+    server.add_handler('/pin/', pin_page)
+    return lambda pin_id: recorded[(int(pin_id) - BOARD_FIRST_PIN_ID) % len(recorded)].video_url
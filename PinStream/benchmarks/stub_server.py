@@ -0,0 +1,194 @@
+"""Local HTTP stub standing in for pinterest.com and the pinimg.com CDN"""
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SINGLE_RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def mp4_box(kind, payload):
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+def stub_mp4(size):
+    """Return size bytes shaped like a faststart MP4: ftyp, then moov, then mdat"""
+    ftyp = mp4_box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    # A movie header plus filler standing in for the sample tables
+    mvhd = mp4_box(b'mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, 15000) + bytes(80))
+    moov = mp4_box(b'moov', mvhd + mp4_box(b'free', bytes(8 * 1024)))
+    header = ftyp + moov + struct.pack('>I', max(size - len(ftyp) - len(moov), 8)) + b'mdat'
+    pattern = bytes(range(256)) * 16
+    body = header + pattern * ((size - len(header)) // len(pattern) + 1)
+    return body[:max(size, len(header))]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve registered routes over keep-alive HTTP/1.1"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        # Stand-in for the TCP + TLS handshake cost of a real upstream
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.throttled():
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.stall_ratio and random.random() < self.server.stall_ratio:
+            time.sleep(self.server.stall)
+
+        route = self.server.route(self.path)
+        if route is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status, headers, body = route
+        headers = dict(headers)
+        requested = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if (status == 200 and requested and headers.get('Accept-Ranges') == 'bytes'
+                and (if_range is None or if_range == headers.get('ETag'))):
+            status, body = self.byte_range(requested, body, headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def byte_range(self, requested, body, headers):
+        """Answer a single byte range like a CDN; anything else gets the whole body"""
+        match = SINGLE_RANGE_PATTERN.fullmatch(requested.strip())
+        if match is None or match.groups() == ('', ''):
+            return 200, body
+        first, last = match.groups()
+        if first:
+            start, stop = int(first), min(int(last) + 1 if last else len(body), len(body))
+        else:
+            start, stop = max(len(body) - int(last), 0), len(body)
+        if start >= len(body) or start >= stop:
+            headers['Content-Range'] = f'bytes */{len(body)}'
+            return 416, b''
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(body)}'
+        return 206, body[start:stop]
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub server counting accepted connections and served requests"""
+    daemon_threads = True
+    # Room for load tests opening hundreds of connections at once
+    request_queue_size = 1024
+
+    def __init__(self, routes=None, latency=0.0, connect_latency=0.0, rate_limit=None, stall_ratio=0.0, stall=0.0,
+                 handler=StubHandler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.routes = routes or {}
+        self.handlers = []
+        self.latency = latency
+        self.connect_latency = connect_latency
+        # Requests per second answered before the rest get 429, like pinterest.com under load
+        self.rate_limit = rate_limit
+        # Share of requests held for `stall` seconds before they are answered
+        self.stall_ratio = stall_ratio
+        self.stall = stall
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.throttled_requests = 0
+        self._answered = deque()
+
+    def throttled(self):
+        """Return whether a request arriving now is over the rate limit"""
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self._answered and self._answered[0] <= now - 1.0:
+                self._answered.popleft()
+            if len(self._answered) >= self.rate_limit:
+                self.throttled_requests += 1
+                return True
+            self._answered.append(now)
+            return False
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-body are expected in load tests
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def route(self, target):
+        """Return (status, headers, body) for a request target, or None for a 404"""
+        path = target.split('?', 1)[0]
+        route = self.routes.get(path)
+        if route is None:
+            for prefix, handler in self.handlers:
+                if path.startswith(prefix):
+                    return handler(target)
+        return route
+
+    def add_handler(self, prefix, handler):
+        """Answer paths under prefix with handler(target), returning (status, headers, body) or None"""
+        self.handlers.append((prefix, handler))
+
+    def add_route(self, path, body, content_type='text/html; charset=utf-8', status=200, headers=None):
+        headers = dict(headers or {}, **{'Content-Type': content_type})
+        self.routes[path] = (status, headers, body if isinstance(body, bytes) else body.encode())
+
+    def add_video(self, path, size, etag='"stub-video"'):
+        """Serve a stub MP4 of size bytes with validators and single-range support"""
+        self.add_route(path, stub_mp4(size), content_type='video/mp4', headers={
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Last-Modified': 'Mon, 04 Mar 2024 10:00:00 GMT',
+        })
+
+    def add_redirect(self, path, location, status=302):
+        self.add_route(path, b'', status=status, headers={'Location': location})
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.throttled_requests = 0
+            self._answered.clear()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
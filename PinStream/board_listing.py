@@ -0,0 +1,163 @@
+"""Lazy listing of the pins on Pinterest boards and profiles, one page of the listing at a time"""
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import http_client
+
+# Pins asked for per listing page, and most pins listed per board or profile
+BOARD_PAGE_SIZE = int(os.environ.get("BOARD_PAGE_SIZE", "25"))
+BOARD_MAX_PINS = int(os.environ.get("BOARD_MAX_PINS", "2000"))
+
+COLLECTION_HOSTS = {'pinterest.com', 'www.pinterest.com', 'pinterest.co.uk', 'br.pinterest.com'}
+# First path segments that are Pinterest's own pages rather than usernames
+RESERVED_PATHS = {
+    'pin', 'search', 'ideas', 'today', 'explore', 'settings', 'business', 'resource', 'categories',
+    'topics', 'videos', 'news_hub', 'login', 'signup', 'password', 'notifications', 'messages',
+}
+# Profile tabs listing the profile's own pins; other tabs (_saved...) list boards
+PROFILE_PIN_TABS = {'', '_created', 'pins'}
+# Bookmark Pinterest hands out after the last page
+END_BOOKMARK = '-end-'
+
+API_HEADERS = {
+    'Accept': 'application/json, text/javascript, */*; q=0.01',
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+
+class Collection(namedtuple('Collection', ['kind', 'origin', 'username', 'slug'])):
+    """A board (kind 'board') or a profile's pins (kind 'profile') on origin"""
+    __slots__ = ()
+
+    @property
+    def path(self):
+        return f"/{self.username}/{self.slug}/" if self.slug else f"/{self.username}/"
+
+    def pin_url(self, pin_id):
+        return f"{self.origin}/pin/{pin_id}/"
+
+
+def parse_collection_url(url):
+    """Return the Collection a board or profile URL points to, or None for anything else"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    parsed = urlparse(url)
+    if parsed.netloc.lower() not in COLLECTION_HOSTS:
+        return None
+
+    segments = [segment for segment in parsed.path.split('/') if segment]
+    if not segments or len(segments) > 2 or segments[0].lower() in RESERVED_PATHS:
+        return None
+    origin = f"{parsed.scheme}://{parsed.netloc.lower()}"
+    if len(segments) == 1 or segments[1].lower() in PROFILE_PIN_TABS:
+        return Collection('profile', origin, segments[0], None)
+    if segments[1].startswith('_'):
+        return None
+    return Collection('board', origin, segments[0], segments[1])
+
+
+class PinLister:
+    """Page through board and profile listings with Pinterest's resource API.
+
+    iter_pins() returns a generator: a page is only requested once the pins
+    of the one before were consumed, so a listing never holds more than a
+    page. A board's ID is looked up up front, so an unknown board fails
+    before the first pin is asked for.
+    Pins are not deduplicated across pages; repeats are answered by the
+    metadata cache.
+    """
+
+    def __init__(self, headers=None, page_size=BOARD_PAGE_SIZE, max_pins=BOARD_MAX_PINS):
+        self.headers = dict(headers or {}, **API_HEADERS)
+        self.page_size = page_size
+        self.max_pins = max_pins
+        self._lock = threading.Lock()
+        self.listings = 0
+        self.pages = 0
+        self.pins = 0
+
+    def iter_pins(self, collection, limit=None):
+        """Return an iterator of the URLs of a collection's pins in listing order, at most limit (and max_pins).
+
+        Raises LookupError for an unknown board, and requests.RequestException
+        if its lookup fails.
+        """
+        limit = self.max_pins if limit is None else min(limit, self.max_pins)
+        if collection.kind == 'board':
+            resource, options = 'BoardFeedResource', {'board_id': self.board_id(collection)}
+        else:
+            resource, options = 'UserPinsResource', {'username': collection.username}
+        with self._lock:
+            self.listings += 1
+        return self._iter_pins(collection, resource, options, limit)
+
+    def _iter_pins(self, collection, resource, options, limit):
+        listed = 0
+        bookmark = None
+        while listed < limit:
+            page_options = dict(options, page_size=min(self.page_size, limit - listed))
+            if bookmark:
+                page_options['bookmarks'] = [bookmark]
+            page, bookmark = self._page(collection, resource, page_options)
+            for item in page:
+                # Listings mix in stories and ads next to the pins
+                if not isinstance(item, dict) or item.get('type', 'pin') != 'pin':
+                    continue
+                pin_id = str(item.get('id', ''))
+                if not pin_id.isdigit():
+                    continue
+                listed += 1
+                with self._lock:
+                    self.pins += 1
+                yield collection.pin_url(pin_id)
+                if listed >= limit:
+                    break
+            if not page or not bookmark or bookmark == END_BOOKMARK:
+                break
+        logging.debug("Listed %s pins of %s", listed, collection.path)
+
+    def board_id(self, collection):
+        """Look up the numeric ID the board feed is keyed by; raise LookupError for an unknown board"""
+        data, _ = self._page(collection, 'BoardResource', {
+            'username': collection.username,
+            'slug': collection.slug,
+            'field_set_key': 'detailed',
+        })
+        board_id = data.get('id') if isinstance(data, dict) else None
+        if not board_id:
+            raise LookupError(f"No board found at {collection.path}")
+        return board_id
+
+    def _page(self, collection, resource, options):
+        """Fetch one resource response; return its data and the bookmark of the next page.
+
+        Raises LookupError when the resource API answers 404, as it does for an
+        unknown board or user.
+        """
+        response = http_client.get(f"{collection.origin}/resource/{resource}/get/", headers=self.headers, params={
+            'source_url': collection.path,
+            'data': json.dumps({'options': options, 'context': {}}, separators=(',', ':')),
+        })
+        if response.status_code == 404:
+            response.close()
+            raise LookupError(f"No {collection.kind} found at {collection.path}")
+        response.raise_for_status()
+        payload = response.json()
+        with self._lock:
+            self.pages += 1
+
+        resource_response = payload.get('resource_response') or {}
+        bookmark = resource_response.get('bookmark')
+        if bookmark is None:
+            # Older responses only echo the bookmark in the resource's options
+            bookmarks = (payload.get('resource') or {}).get('options', {}).get('bookmarks') or [None]
+            bookmark = bookmarks[0]
+        return resource_response.get('data') or [], bookmark
+
+    def stats(self):
+        with self._lock:
+            return {'listings': self.listings, 'pages': self.pages, 'pins': self.pins}
@@ -0,0 +1,141 @@
+"""Adaptive ordering of video detection methods by observed hit rate and cost"""
+import logging
+import os
+import random
+import threading
+import time
+
+# Reorder detection methods from their observed hit rates and costs
+ADAPTIVE_DETECTION = os.environ.get("ADAPTIVE_DETECTION", "false").lower() in ('1', 'true', 'yes')
+# Runs of every method in a group before its order is changed
+DETECTION_MIN_SAMPLES = int(os.environ.get("DETECTION_MIN_SAMPLES", "50"))
+# Weight of the newest run in the moving hit rate and cost averages
+DETECTION_DECAY = float(os.environ.get("DETECTION_DECAY", "0.02"))
+# Seconds without a hit after which a method is skipped; 0 never skips
+DETECTION_STALE_SECONDS = float(os.environ.get("DETECTION_STALE_SECONDS", "86400"))
+# Share of detections run in the default order with nothing skipped, to keep measuring every method
+DETECTION_EXPLORE = float(os.environ.get("DETECTION_EXPLORE", "0.05"))
+
+# Floor on a method's cost, so a near-free method does not divide by zero
+MIN_COST = 1e-6
+
+
+class MethodStats:
+    """Moving hit rate and cost of one detection method"""
+
+    def __init__(self, now):
+        self.runs = 0
+        self.hits = 0
+        self.hit_rate = 0.0
+        self.cost = 0.0
+        self.last_hit = now
+
+    def record(self, seconds, hit, decay, now):
+        self.runs += 1
+        if self.runs == 1:
+            self.hit_rate = 1.0 if hit else 0.0
+            self.cost = seconds
+        else:
+            self.hit_rate += decay * ((1.0 if hit else 0.0) - self.hit_rate)
+            self.cost += decay * (seconds - self.cost)
+        if hit:
+            self.hits += 1
+            self.last_hit = now
+
+    @property
+    def score(self):
+        # Running methods by falling hit-rate/cost ratio minimises the expected
+        # work spent before the first hit
+        return self.hit_rate / max(self.cost, MIN_COST)
+
+
+class DetectionScheduler:
+    """Decide the order in which a group of detection methods is tried.
+
+    Every run is recorded. When enabled and every method of a group has
+    min_samples runs, the group is sorted by hit rate over cost and methods
+    without a hit for stale_after seconds are left out. An explore fraction of
+    detections still use the default order with nothing skipped.
+    """
+
+    def __init__(self, enabled=ADAPTIVE_DETECTION, min_samples=DETECTION_MIN_SAMPLES, decay=DETECTION_DECAY,
+                 stale_after=DETECTION_STALE_SECONDS, explore=DETECTION_EXPLORE):
+        self.enabled = enabled
+        self.min_samples = min_samples
+        self.decay = decay
+        self.stale_after = stale_after
+        self.explore = explore
+        self._stats = {}
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.explored = 0
+        self.skipped = 0
+
+    def _method(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats.setdefault(name, MethodStats(time.time()))
+        return stats
+
+    def record(self, name, seconds, hit):
+        with self._lock:
+            self._method(name).record(seconds, hit, self.decay, time.time())
+
+    def order(self, group, methods):
+        """Return the (name, find) pairs of methods in the order to try them"""
+        with self._lock:
+            self._groups[group] = [name for name, _ in methods]
+            for name, _ in methods:
+                self._method(name)
+            if not self.enabled or not self._warmed_up(methods):
+                return methods
+            if random.random() < self.explore:
+                self.explored += 1
+                return methods
+
+            now = time.time()
+            ordered = []
+            for position, (name, find) in enumerate(methods):
+                stats = self._stats[name]
+                if self.stale_after and now - stats.last_hit > self.stale_after:
+                    self.skipped += 1
+                    continue
+                # Ties keep the default order
+                ordered.append((-stats.score, position, name, find))
+        ordered.sort(key=lambda entry: entry[:2])
+        logging.debug("Detection order for %s: %s", group, [entry[2] for entry in ordered])
+        return [(name, find) for _, _, name, find in ordered]
+
+    def _warmed_up(self, methods):
+        return all(self._stats[name].runs >= self.min_samples for name, _ in methods)
+
+    def snapshot(self):
+        """Return each group's current order and the stats behind it, for debugging"""
+        with self._lock:
+            now = time.time()
+            groups = {}
+            for group, names in self._groups.items():
+                warmed_up = all(self._stats[name].runs >= self.min_samples for name in names)
+                ranked = sorted(names, key=lambda name: -self._stats[name].score) if warmed_up else list(names)
+                groups[group] = {
+                    'adaptive': self.enabled and warmed_up,
+                    'order': [name for name in ranked
+                              if not (self.enabled and warmed_up and self.stale_after
+                                      and now - self._stats[name].last_hit > self.stale_after)],
+                    'methods': {
+                        name: {
+                            'runs': self._stats[name].runs,
+                            'hits': self._stats[name].hits,
+                            'hit_rate': round(self._stats[name].hit_rate, 4),
+                            'cost_ms': round(self._stats[name].cost * 1000, 3),
+                            'seconds_since_hit': round(now - self._stats[name].last_hit, 1),
+                        }
+                        for name in names
+                    },
+                }
+            return {
+                'enabled': self.enabled,
+                'explored': self.explored,
+                'skipped': self.skipped,
+                'groups': groups,
+            }
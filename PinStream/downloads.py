@@ -0,0 +1,355 @@
+"""Byte-range and conditional-request aware proxying of upstream video files"""
+import os
+import re
+import secrets
+
+from flask import Response, send_file
+from werkzeug.http import parse_date, parse_etags, parse_if_range_header, unquote_etag
+
+from metrics import Counter
+
+# Bytes read from upstream and handed to the WSGI server per iteration
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", "65536"))
+
+# Client request headers passed on to the CDN so it can do range and
+# conditional work itself
+FORWARDED_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+
+# Upstream validators relayed to the client on every response
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+
+VIDEO_MIMETYPE = 'video/mp4'
+
+DOWNLOAD_BYTES = Counter('pinstream_download_bytes_total', 'Video bytes sent by /download, by where they came from',
+                         ['source'])
+DOWNLOAD_RESPONSES = Counter('pinstream_downloads_total', '/download responses by body source and status',
+                             ['source', 'status'])
+
+# One "first-last", "first-" or "-suffix" byte range spec
+BYTE_RANGE_SPEC = re.compile(r'\s*(\d*)\s*-\s*(\d*)\s*')
+
+
+def upstream_headers(base_headers, client_headers):
+    """Return base_headers plus the client's range and conditional headers"""
+    headers = dict(base_headers)
+    for name in FORWARDED_REQUEST_HEADERS:
+        value = client_headers.get(name)
+        if value:
+            headers[name] = value
+    return headers
+
+
+def iter_upstream(upstream, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield the upstream body exactly as sent and release the connection afterwards"""
+    try:
+        # Undecoded, so the bytes match the upstream Content-Length and ranges
+        for chunk in upstream.raw.stream(chunk_size, decode_content=False):
+            if chunk:
+                yield chunk
+    finally:
+        # Hand the connection back to the pool even if the client went away
+        upstream.close()
+
+
+def iter_counted(chunks, source):
+    """Yield chunks, adding their size to the bytes sent from source"""
+    counter = DOWNLOAD_BYTES.labels(source)
+    try:
+        for chunk in chunks:
+            counter.inc(len(chunk))
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def parse_byte_ranges(value):
+    """Parse a Range header into (first, last) pairs; last or first is None when open.
+
+    Returns None when the header is missing or not a valid bytes range, in
+    which case it is ignored. Unlike werkzeug's parser, overlapping and
+    unordered ranges are accepted and merged later.
+    """
+    if not value:
+        return None
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = BYTE_RANGE_SPEC.fullmatch(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        first = int(first) if first else None
+        last = int(last) if last else None
+        if first is not None and last is not None and last < first:
+            return None
+        ranges.append((first, last))
+    return ranges
+
+
+def resolve_ranges(ranges, length):
+    """Turn parsed byte ranges into sorted, merged (start, stop) pairs within length.
+
+    Returns an empty list when no range is satisfiable.
+    """
+    spans = []
+    for first, last in ranges:
+        if first is None:
+            start, stop = max(length - last, 0), length
+        else:
+            start = first
+            stop = length if last is None else min(last + 1, length)
+        if start < stop:
+            spans.append((start, stop))
+    spans.sort()
+
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+class PartSlicer:
+    """Cut (prefix, start, stop) parts out of a body fed to it chunk by chunk.
+
+    It does no I/O, so the sync and async /download paths frame ranges and
+    multipart/byteranges bodies the same way. Parts must be ascending and
+    must not overlap.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.offset = 0
+        self.index = 0
+        self.started = False
+
+    @property
+    def done(self):
+        """Whether every part is complete, so the rest of the body need not be read"""
+        return self.index >= len(self.parts)
+
+    def feed(self, chunk):
+        """Return the pieces to send for the next chunk of the body, each part's prefix first"""
+        pieces = []
+        chunk_end = self.offset + len(chunk)
+        while not self.done:
+            prefix, start, stop = self.parts[self.index]
+            if start >= chunk_end:
+                break
+            piece = chunk[max(start - self.offset, 0):min(stop, chunk_end) - self.offset]
+            if piece:
+                if not self.started and prefix:
+                    pieces.append(prefix)
+                self.started = True
+                pieces.append(piece)
+            if stop > chunk_end:
+                break
+            self.index += 1
+            self.started = False
+        self.offset = chunk_end
+        return pieces
+
+
+def iter_parts(chunks, parts, closing=b''):
+    """Yield each (prefix, start, stop) part cut from chunks, then closing"""
+    slicer = PartSlicer(parts)
+    try:
+        for chunk in chunks:
+            yield from slicer.feed(chunk)
+            if slicer.done:
+                break
+        if closing:
+            yield closing
+    finally:
+        chunks.close()
+
+
+def multipart_layout(spans, length, content_type):
+    """Return (boundary, parts, closing delimiter, total size) of a multipart/byteranges body"""
+    boundary = secrets.token_hex(16)
+    parts = [
+        (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n'.encode('ascii'), start, stop)
+        for start, stop in spans
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    size = sum(len(prefix) + stop - start for prefix, start, stop in parts) + len(closing)
+    return boundary, parts, closing, size
+
+
+def etag_value(headers):
+    """Return (etag, is_weak) from a response's headers, or (None, False)"""
+    etag = headers.get('ETag')
+    if not etag:
+        return None, False
+    return unquote_etag(etag)
+
+
+def range_applies(request_headers, source_headers):
+    """Whether the client's If-Range (if any) still matches the upstream representation"""
+    if_range = parse_if_range_header(request_headers.get('If-Range'))
+    if if_range.etag is not None:
+        # If-Range needs a strong match
+        etag, weak = etag_value(source_headers)
+        return etag is not None and not weak and etag == if_range.etag
+    if if_range.date is not None:
+        last_modified = parse_date(source_headers.get('Last-Modified'))
+        return last_modified is not None and last_modified == if_range.date
+    return True
+
+
+def not_modified(request_headers, source_headers):
+    """Whether the client's If-None-Match matches the upstream ETag"""
+    if_none_match = parse_etags(request_headers.get('If-None-Match'))
+    if not if_none_match:
+        return False
+    etag, _ = etag_value(source_headers)
+    return etag is not None and if_none_match.contains_weak(etag)
+
+
+class DownloadPlan:
+    """Status, headers and body layout of a /download response, independent of the server.
+
+    parts is None when the upstream body is relayed as it is; otherwise it
+    lists the (prefix, start, stop) spans of the upstream body to send, followed
+    by closing. cacheable marks a complete, unencoded body of length bytes.
+    """
+
+    def __init__(self, status, headers, content_type=VIDEO_MIMETYPE, has_body=True,
+                 parts=None, closing=b'', length=None, cacheable=False):
+        self.status = status
+        self.headers = headers
+        self.content_type = content_type
+        self.has_body = has_body
+        self.parts = parts
+        self.closing = closing
+        self.length = length
+        self.cacheable = cacheable
+
+
+def plan_download(status, source_headers, request_headers, method, filename):
+    """Decide the client response for an upstream video response.
+
+    206, 304 and 416 answers from the CDN are relayed as they are. When the CDN
+    sends the full file for a range request, the ranges are cut out locally.
+    """
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    for name in VALIDATOR_HEADERS:
+        if name in source_headers:
+            headers[name] = source_headers[name]
+
+    if status in (304, 416) or (status == 200 and not_modified(request_headers, source_headers)):
+        if status == 416 and 'Content-Range' in source_headers:
+            headers['Content-Range'] = source_headers['Content-Range']
+        return DownloadPlan(304 if status == 200 else status, headers, content_type=None, has_body=False)
+
+    content_encoding = source_headers.get('Content-Encoding')
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    length = source_headers.get('Content-Length')
+    length = int(length) if length and length.isdigit() else None
+
+    if status == 206:
+        # The CDN did the range work, including any multipart/byteranges framing
+        for name in ('Content-Range', 'Content-Length'):
+            if name in source_headers:
+                headers[name] = source_headers[name]
+        headers['Accept-Ranges'] = 'bytes'
+        content_type = source_headers.get('Content-Type', VIDEO_MIMETYPE)
+        if not content_type.startswith('multipart/'):
+            content_type = VIDEO_MIMETYPE
+        return DownloadPlan(206, headers, content_type=content_type)
+
+    if length is None:
+        headers['Accept-Ranges'] = 'none'
+        return DownloadPlan(status, headers)
+
+    headers['Accept-Ranges'] = 'bytes'
+    ranges = parse_byte_ranges(request_headers.get('Range'))
+    if ranges and range_applies(request_headers, source_headers):
+        spans = resolve_ranges(ranges, length)
+        if not spans:
+            headers['Content-Range'] = f'bytes */{length}'
+            return DownloadPlan(416, headers, content_type=None, has_body=False)
+        if len(spans) == 1:
+            start, stop = spans[0]
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+            headers['Content-Length'] = str(stop - start)
+            return DownloadPlan(206, headers, parts=[(b'', start, stop)], length=length)
+        boundary, parts, closing, size = multipart_layout(spans, length, VIDEO_MIMETYPE)
+        headers['Content-Length'] = str(size)
+        return DownloadPlan(206, headers, content_type=f'multipart/byteranges; boundary={boundary}',
+                            parts=parts, closing=closing, length=length)
+
+    headers['Content-Length'] = str(length)
+    return DownloadPlan(status, headers, length=length,
+                        cacheable=not content_encoding and method != 'HEAD')
+
+
+def proxy_response(upstream, request, filename, chunk_size=DOWNLOAD_CHUNK_SIZE, fill=None):
+    """Build the client response for a streamed upstream video response.
+
+    A full-body response is passed through fill(length, headers, chunks), if
+    given, so it can be cached while it streams.
+    """
+    plan = plan_download(upstream.status_code, upstream.headers, request.headers, request.method, filename)
+    DOWNLOAD_RESPONSES.labels('upstream', str(plan.status)).inc()
+    if not plan.has_body:
+        upstream.close()
+        return Response(status=plan.status, headers=plan.headers)
+
+    body = iter_upstream(upstream, chunk_size)
+    if plan.parts is not None:
+        body = iter_parts(body, plan.parts, plan.closing)
+    elif fill is not None and plan.cacheable:
+        body = fill(plan.length, upstream.headers, body)
+    return Response(iter_counted(body, 'upstream'), status=plan.status, headers=plan.headers,
+                    content_type=plan.content_type)
+
+
+def segmented_response(download, filename, chunk_size=DOWNLOAD_CHUNK_SIZE, fill=None, source='segmented'):
+    """Build the client response for a SegmentedDownload or PrefetchedVideo, with the same fill hook as proxy_response"""
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'Accept-Ranges': 'bytes'}
+    headers.update(download.response_headers)
+    headers['Content-Length'] = str(download.length)
+    body = download.iter_chunks(chunk_size)
+    if fill is not None:
+        body = fill(download.length, download.response_headers, body)
+    DOWNLOAD_RESPONSES.labels(source, '200').inc()
+    return Response(iter_counted(body, source), mimetype=VIDEO_MIMETYPE, headers=headers)
+
+
+def is_plain_download(request):
+    """Whether the request wants the whole body unconditionally"""
+    return request.method == 'GET' and not any(name in request.headers for name in FORWARDED_REQUEST_HEADERS)
+
+
+def send_cached(cached, request, filename):
+    """Serve a cached video file; ranges and conditionals are answered by werkzeug.
+
+    The body goes out through the server's file wrapper (sendfile under
+    gunicorn), or X-Sendfile when USE_X_SENDFILE is set, not through Python.
+    """
+    etag, weak = unquote_etag(cached.headers['ETag']) if 'ETag' in cached.headers else (None, False)
+    response = send_file(
+        cached.path,
+        mimetype=VIDEO_MIMETYPE,
+        as_attachment=True,
+        download_name=filename,
+        conditional=True,
+        # Keep the CDN's validator so If-Range from an uncached response still matches
+        etag=etag if etag and not weak else True,
+        last_modified=parse_date(cached.headers.get('Last-Modified')),
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    DOWNLOAD_RESPONSES.labels('cache', str(response.status_code)).inc()
+    if request.method != 'HEAD' and response.content_length:
+        # Sent by the server's file wrapper, so counted up front
+        DOWNLOAD_BYTES.labels('cache').inc(response.content_length)
+    return response
@@ -0,0 +1,61 @@
+"""Lazily built, pruned BeautifulSoup trees for pin pages"""
+import os
+import re
+
+from metrics import Histogram
+
+# BeautifulSoup tree builder; unset, lxml is used when installed (tag_filters.DEFAULT_PARSER)
+HTML_PARSER = os.environ.get("HTML_PARSER")
+
+PARSE_SECONDS = Histogram('pinstream_parse_seconds', 'Time spent building pruned page trees', ['tree'])
+
+# Raw-text hints that a DOM-based detection method can possibly succeed
+STRUCTURED_DATA_HINT = 'application/ld+json'
+VIDEO_ELEMENT_HINT = re.compile(r'<video|<source|data-video-url|data-src|data-content-url', re.IGNORECASE)
+
+
+def parse(markup, parser, tree):
+    """Build the pruned tree named tree ('meta' or 'detection') of markup"""
+    # bs4 and lxml are loaded by the first parse instead of at startup
+    from bs4 import BeautifulSoup
+    import tag_filters
+    only = tag_filters.META_FILTER if tree == 'meta' else tag_filters.DETECTION_FILTER
+    with PARSE_SECONDS.labels(tree).time():
+        return BeautifulSoup(markup, parser or tag_filters.DEFAULT_PARSER, parse_only=only)
+
+
+class PageDocument:
+    """A pin page's markup, parsed on first use and only as far as callers need"""
+
+    def __init__(self, markup, text, parser=HTML_PARSER, meta_end=None):
+        self.markup = markup
+        self.text = text
+        self.parser = parser
+        # Where the <meta> and <title> tags end, when the caller knows
+        self.meta_end = meta_end
+        self._soup = None
+        self._meta_soup = None
+
+    @property
+    def soup(self):
+        """Tree holding every element the detection methods look at"""
+        if self._soup is None:
+            self._soup = parse(self.markup, self.parser, 'detection')
+            self._meta_soup = None
+        return self._soup
+
+    @property
+    def meta_soup(self):
+        """Tree holding <meta> and <title>; the full tree when it is already built"""
+        if self._soup is not None:
+            return self._soup
+        if self._meta_soup is None:
+            markup = self.markup[:self.meta_end] if self.meta_end else self.markup
+            self._meta_soup = parse(markup, self.parser, 'meta')
+        return self._meta_soup
+
+    def may_have_structured_data(self):
+        return STRUCTURED_DATA_HINT in self.text
+
+    def may_have_video_elements(self):
+        return VIDEO_ELEMENT_HINT.search(self.text) is not None
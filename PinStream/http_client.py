@@ -0,0 +1,154 @@
+"""Process-wide pooled HTTP sessions for every upstream fetch"""
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import Counter, Histogram
+from upstream_policy import UpstreamPolicy
+
+# Number of per-host pools kept (pinterest.com, pin.it, pinimg.com hosts...)
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+# Keep-alive connections kept per host; size it to the worker thread count
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "16"))
+
+# Default timeouts in seconds for page fetches and video downloads
+PAGE_TIMEOUT = float(os.environ.get("HTTP_PAGE_TIMEOUT", "10"))
+DOWNLOAD_TIMEOUT = float(os.environ.get("HTTP_DOWNLOAD_TIMEOUT", "30"))
+
+UPSTREAM_SECONDS = Histogram(
+    'pinstream_upstream_seconds',
+    'Upstream HTTP timings by phase: connect (DNS and TCP), tls, ttfb (until response headers), body',
+    ['phase'],
+)
+UPSTREAM_REQUESTS = Counter('pinstream_upstream_requests_total', 'Upstream HTTP requests by method and status',
+                            ['method', 'status'])
+
+# Per-host rate limits, retries, timeouts and circuit breakers, used when UPSTREAM_POLICY is on
+policy = UpstreamPolicy()
+
+_lock = threading.Lock()
+_local = threading.local()
+_adapter = None
+_adapter_pid = None
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """Records how long opening each new upstream connection takes"""
+
+    def _new_conn(self):
+        with UPSTREAM_SECONDS.labels('connect').time():
+            return super()._new_conn()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """Records the TCP connect and TLS handshake of each new upstream connection separately"""
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        sock = super()._new_conn()
+        self._connect_seconds = time.perf_counter() - started
+        UPSTREAM_SECONDS.labels('connect').observe(self._connect_seconds)
+        return sock
+
+    def connect(self):
+        self._connect_seconds = 0.0
+        started = time.perf_counter()
+        super().connect()
+        UPSTREAM_SECONDS.labels('tls').observe(time.perf_counter() - started - self._connect_seconds)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools open timed connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def get_adapter():
+    """Return the connection-pooling adapter shared by every thread in this process"""
+    global _adapter, _adapter_pid
+    pid = os.getpid()
+    if _adapter is None or _adapter_pid != pid:
+        with _lock:
+            # Sockets must not be shared with a parent process after a fork
+            if _adapter is None or _adapter_pid != pid:
+                _adapter = TimedHTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                _adapter_pid = pid
+    return _adapter
+
+
+def get_session():
+    """Return this thread's session, backed by the shared connection pools"""
+    adapter = get_adapter()
+    session = getattr(_local, 'session', None)
+    if session is None or session.get_adapter('https://') is not adapter:
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # Stay stateless like plain requests.get: cookies only live for the
+        # redirect chain of a single request
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        _local.session = session
+    return session
+
+
+def request(method, url, timeout=None, **kwargs):
+    """Send a request through the shared pools, recording its timings; timeout defaults to PAGE_TIMEOUT"""
+    session = get_session()
+
+    def send(timeout):
+        started = time.perf_counter()
+        response = session.request(method, url, timeout=timeout, **kwargs)
+        # elapsed runs until the final response's headers were parsed
+        UPSTREAM_SECONDS.labels('ttfb').observe(response.elapsed.total_seconds())
+        if not kwargs.get('stream'):
+            UPSTREAM_SECONDS.labels('body').observe(
+                max(time.perf_counter() - started - response.elapsed.total_seconds(), 0.0))
+        UPSTREAM_REQUESTS.labels(method, str(response.status_code)).inc()
+        return response
+
+    return policy.send(method, url, PAGE_TIMEOUT if timeout is None else timeout, send)
+
+
+def get(url, timeout=None, **kwargs):
+    """GET through the shared pools; timeout defaults to PAGE_TIMEOUT"""
+    kwargs.setdefault('allow_redirects', True)
+    return request('GET', url, timeout, **kwargs)
+
+
+def head(url, timeout=None, **kwargs):
+    """HEAD through the shared pools; timeout defaults to PAGE_TIMEOUT"""
+    kwargs.setdefault('allow_redirects', False)
+    return request('HEAD', url, timeout, **kwargs)
+
+
+def pool_stats():
+    """Return the connection pools currently held, keyed by scheme://host:port"""
+    pools = get_adapter().poolmanager.pools
+    stats = {}
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+    return stats
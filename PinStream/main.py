@@ -1,18 +1,46 @@
+import gc
 import os
 import re
 import json
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from urllib.parse import urlparse, urljoin
 from flask import Flask, render_template, request, jsonify, Response, stream_template
 import requests
-from bs4 import BeautifulSoup
-import trafilatura
+from html_document import PageDocument
+from video_scanner import PAGE_SCANNER, SCRIPT_SCANNER
+from pin_data import find_video_in_json_ld, find_video_in_page_state
+import http_client
+from http_client import PAGE_TIMEOUT, DOWNLOAD_TIMEOUT
+from metadata_cache import create_metadata_cache
+from short_links import ShortLinkResolver, is_short_link
+from single_flight import SINGLE_FLIGHT_LOCK_DIR, SingleFlight
+from downloads import is_plain_download, proxy_response, segmented_response, send_cached, upstream_headers
+from segmented_fetch import SEGMENTED_DOWNLOAD, SegmentedFetcher
+from video_cache import VideoCache
+from video_prefetch import VideoPrefetcher
+from detection_scheduler import DetectionScheduler
+from page_stream import STREAMING_FETCH, read_pin_page
+from board_listing import PinLister, parse_collection_url
+import metrics
+from metrics import Counter, Histogram
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Log level name (DEBUG, INFO, WARNING...); DEBUG also logs every upstream connection
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+if LOG_LEVEL in logging.getLevelNamesMapping():
+    logging.basicConfig(level=LOG_LEVEL)
+else:
+    logging.basicConfig(level=logging.INFO)
+    logging.warning("Unknown LOG_LEVEL %r; logging at INFO", LOG_LEVEL)
+    LOG_LEVEL = 'INFO'
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+# Let a fronting nginx/Apache send cached video files itself
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE", "false").lower() in ('1', 'true', 'yes')
 
 # Headers to mimic a real browser
 HEADERS = {
@@ -24,6 +52,111 @@ HEADERS = {
     'Upgrade-Insecure-Requests': '1',
 }
 
+# Headers to mimic Mobile Safari for the mobile fallbacks
+MOBILE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# Fetch the desktop and mobile pin pages concurrently and take whichever
+# shows a video first
+HEDGED_FETCH = os.environ.get("HEDGED_FETCH", "false").lower() in ('1', 'true', 'yes')
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "16"))
+
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+# Batch inspections: URLs accepted per request, default and maximum parallel inspections
+BATCH_MAX_URLS = int(os.environ.get("BATCH_MAX_URLS", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+
+# Page characters handed to the trafilatura fallback; it runs in fast mode on at most this much
+TRAFILATURA_MAX_CHARS = int(os.environ.get("TRAFILATURA_MAX_CHARS", str(512 * 1024)))
+
+# Board and profile inspections: pins queued ahead of the inspectors, per inspector
+BOARD_QUEUE_DEPTH = int(os.environ.get("BOARD_QUEUE_DEPTH", "2"))
+
+# Where inspections spend their time, and which detection methods find videos
+STAGE_SECONDS = Histogram('pinstream_stage_seconds', 'Time spent in each pin scraping stage', ['stage'])
+DETECTION_SECONDS = Histogram('pinstream_detection_seconds', 'Time spent in each video detection method', ['method'])
+DETECTION_RESULTS = Counter('pinstream_detection_total', 'Video detection attempts by method and result',
+                            ['method', 'result'])
+
+# Order in which detection methods are tried, adapted to their hit rates when ADAPTIVE_DETECTION is on
+detection_scheduler = DetectionScheduler()
+
+# Inspected pin metadata, keyed by canonical pin ID
+metadata_cache = create_metadata_cache()
+
+# pin.it short codes and the canonical pin URLs they lead to
+short_link_resolver = ShortLinkResolver(headers=HEADERS)
+
+# In-flight inspections by pin ID, shared by concurrent requests for the same pin. Other
+# workers only benefit from waiting when the result lands in the shared SQLite cache
+if SINGLE_FLIGHT_LOCK_DIR and metadata_cache.backend is None:
+    logging.warning("SINGLE_FLIGHT_LOCK_DIR needs METADATA_CACHE_DB; coalescing within each worker only")
+inspection_flights = SingleFlight(lock_dir=SINGLE_FLIGHT_LOCK_DIR if metadata_cache.backend is not None else '')
+
+# Downloaded video bodies on disk, keyed by video URL; off unless VIDEO_CACHE_DIR is set
+video_cache = VideoCache()
+
+# Concurrent byte-range fetching of /download bodies, used when SEGMENTED_DOWNLOAD is on
+segmented_fetcher = SegmentedFetcher()
+
+# Leading bytes of videos found by /inspect, used when VIDEO_PREFETCH is on
+video_prefetcher = VideoPrefetcher(headers=HEADERS)
+
+# Pin listings of boards and profiles for /inspect/board
+pin_lister = PinLister(headers=HEADERS)
+
+def reset_after_fork():
+    """Drop thread pools inherited from a preloading parent; their threads did not survive the fork"""
+    global _fetch_executor, _fetch_executor_lock
+    _fetch_executor = None
+    _fetch_executor_lock = threading.Lock()
+    segmented_fetcher.after_fork()
+    video_prefetcher.after_fork()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+def collect_component_stats():
+    """Report cache, coalescing, segment, detection order and connection pool stats as gauges"""
+    components = [
+        ('metadata_cache', metadata_cache.stats()),
+        ('short_links', short_link_resolver.stats()),
+        ('inspection_flights', inspection_flights.stats()),
+        ('video_cache', video_cache.stats()),
+        ('segmented_fetch', segmented_fetcher.stats()),
+        ('video_prefetch', video_prefetcher.stats()),
+        ('pin_listing', pin_lister.stats()),
+    ]
+    yield ('pinstream_component_stat', 'Counters and sizes reported by caches, coalescing and fetchers',
+           [({'component': component, 'stat': stat}, value)
+            for component, stats in components for stat, value in stats.items()])
+    snapshot = detection_scheduler.snapshot()
+    yield ('pinstream_detection_rank', 'Position of each detection method in its group\'s current order',
+           [({'group': group, 'method': method}, rank)
+            for group, state in snapshot['groups'].items() for rank, method in enumerate(state['order'])])
+    yield ('pinstream_detection_hit_rate', 'Moving hit rate of each detection method',
+           [({'method': method}, stats['hit_rate'])
+            for state in snapshot['groups'].values() for method, stats in state['methods'].items()])
+    hosts = http_client.policy.stats()
+    yield ('pinstream_upstream_circuit_open', 'Whether each upstream host\'s circuit breaker is open or half open',
+           [({'host': host}, stats['open']) for host, stats in hosts.items()])
+    yield ('pinstream_upstream_latency_p99_seconds', 'Recent p99 time to first byte of each upstream host',
+           [({'host': host}, stats['p99_seconds']) for host, stats in hosts.items()])
+    pools = http_client.pool_stats()
+    yield ('pinstream_pool_connections_opened', 'Connections opened by each upstream connection pool',
+           [({'pool': pool}, stats['connections_opened']) for pool, stats in pools.items()])
+    yield ('pinstream_pool_requests', 'Requests sent through each upstream connection pool',
+           [({'pool': pool}, stats['requests']) for pool, stats in pools.items()])
+
+metrics.REGISTRY.add_collector(collect_component_stats)
+
 def is_valid_pinterest_url(url):
     """Check if URL is a valid Pinterest pin URL"""
     try:
@@ -47,7 +180,7 @@ def is_valid_pinterest_url(url):
         return '/pin/' in path_lower or path_lower.startswith('/pin/')
         
     except Exception as e:
-        logging.debug(f"URL validation error: {e}")
+        logging.debug("URL validation error: %s", e)
         return False
 
 def extract_pin_id(url):
@@ -63,88 +196,72 @@ def extract_pin_id(url):
             return match.group(1)
     return None
 
-def detect_pinterest_video(soup, page_content, pin_id, url):
+def detect_pinterest_video(document, page_content, pin_id, url, scan=None, mobile_page=None):
     """Advanced Pinterest video detection using multiple methods"""
+    if scan is None:
+        scan = PAGE_SCANNER.scan(page_content, pin_id)
     
-    # Method 1: Look for JSON-LD structured data
-    video_url = find_video_in_structured_data(soup)
-    if video_url:
-        return video_url
-    
-    # Method 2: Search for Pinterest API calls in page content
-    video_url = find_video_in_api_calls(page_content, pin_id)
-    if video_url:
-        return video_url
-    
-    # Method 3: Look for video elements and data attributes
-    video_url = find_video_in_elements(soup)
-    if video_url:
-        return video_url
-    
-    # Method 4: Extract from Pinterest's internal data structures
-    video_url = find_video_in_internal_data(page_content, pin_id)
-    if video_url:
-        return video_url
-    
-    # Method 5: Mobile user-agent approach
-    video_url = try_mobile_extraction(url)
-    if video_url:
-        return video_url
-    
+    # DOM methods only parse the page when its raw text says they can match
+    methods = [
+        # Method 1: Look for JSON-LD structured data
+        ('structured_data', lambda: find_video_in_structured_data(document.soup)
+            if document.may_have_structured_data() else None),
+        # Method 2: Search for Pinterest API calls in page content
+        ('api_calls', lambda: find_video_in_api_calls(page_content, pin_id, scan)),
+        # Method 3: Look for video elements and data attributes
+        ('elements', lambda: find_video_in_elements(document.soup)
+            if document.may_have_video_elements() else None),
+        # Method 4: Extract from Pinterest's internal data structures
+        ('internal_data', lambda: find_video_in_internal_data(page_content, pin_id)),
+        # Method 5: Mobile user-agent approach
+        ('mobile', lambda: try_mobile_extraction(url, mobile_page)),
+    ]
+    return run_detections('primary', methods)
+
+def run_detections(group, methods):
+    """Try (name, find) detection methods in the scheduler's order; return the first video URL found"""
+    for method, find in detection_scheduler.order(group, methods):
+        video_url = run_detection(method, find)
+        if video_url:
+            return video_url
     return None
 
+def run_detection(method, find, *args):
+    """Run one detection method, recording its latency and whether it found a video"""
+    started = time.perf_counter()
+    try:
+        video_url = find(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        DETECTION_SECONDS.labels(method).observe(elapsed)
+    DETECTION_RESULTS.labels(method, 'hit' if video_url else 'miss').inc()
+    detection_scheduler.record(method, elapsed, bool(video_url))
+    return video_url
+
 def find_video_in_structured_data(soup):
     """Look for video URLs in JSON-LD structured data"""
     try:
         scripts = soup.find_all('script', type='application/ld+json')
         for script in scripts:
             try:
-                data = json.loads(script.string)
-                if isinstance(data, dict):
-                    # Look for video-related fields
-                    for key in ['contentUrl', 'embedUrl', 'videoUrl', 'url']:
-                        if key in data and isinstance(data[key], str):
-                            if '.mp4' in data[key] or 'video' in data[key].lower():
-                                return data[key]
-                    
-                    # Check nested objects
-                    if 'video' in data and isinstance(data['video'], dict):
-                        video_obj = data['video']
-                        for key in ['contentUrl', 'embedUrl', 'url']:
-                            if key in video_obj:
-                                return video_obj[key]
+                video_url = find_video_in_json_ld(json.loads(script.string))
+                if video_url:
+                    return video_url
             except (json.JSONDecodeError, AttributeError):
                 continue
     except Exception as e:
-        logging.debug(f"Structured data extraction error: {e}")
+        logging.debug("Structured data extraction error: %s", e)
     return None
 
-def find_video_in_api_calls(page_content, pin_id):
+def find_video_in_api_calls(page_content, pin_id, scan=None):
     """Look for video URLs in Pinterest API responses embedded in page"""
     try:
-        # Advanced Pinterest CDN patterns
-        cdn_patterns = [
-            rf'https://v1\.pinimg\.com/videos/[^"\']*{pin_id}[^"\']*\.mp4[^"\']*',
-            r'https://v1\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*',
-            r'https://i\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*',
-            r'https://v\d*\.pinimg\.com/[^"\']*\.mp4[^"\']*',
-            r'"video_url":"([^"]+\.mp4[^"]*)"',
-            r'"contentUrl":"([^"]+\.mp4[^"]*)"',
-            r'"embedUrl":"([^"]+\.mp4[^"]*)"',
-        ]
-        
-        for pattern in cdn_patterns:
-            matches = re.findall(pattern, page_content, re.IGNORECASE)
-            if matches:
-                for match in matches:
-                    video_url = match if isinstance(match, str) else match[0] if match else None
-                    if video_url and len(video_url) > 20:
-                        # Clean up URL
-                        video_url = video_url.replace('\\u002F', '/').replace('\\', '')
-                        if 'http' in video_url:
-                            return video_url
+        # Advanced Pinterest CDN patterns, matched in a single pass
+        if scan is None:
+            scan = PAGE_SCANNER.scan(page_content, pin_id)
+        return scan.first('api')
     except Exception as e:
-        logging.debug(f"API calls extraction error: {e}")
+        logging.debug("API calls extraction error: %s", e)
     return None
 
 def find_video_in_elements(soup):
@@ -169,51 +286,24 @@ def find_video_in_elements(soup):
                     if isinstance(value, str) and ('.mp4' in value or 'video' in value.lower()):
                         return value
     except Exception as e:
-        logging.debug(f"Element extraction error: {e}")
+        logging.debug("Element extraction error: %s", e)
     return None
 
 def find_video_in_internal_data(page_content, pin_id):
     """Look for video URLs in Pinterest's internal JavaScript data"""
     try:
-        # Look for Pinterest's internal data structures
-        js_patterns = [
-            r'window\.__PWS_DATA__\s*=\s*({.+?});',
-            r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
-            r'"videos":\s*\[([^\]]+)\]',
-            r'"video":\s*({[^}]+})',
-        ]
-        
-        for pattern in js_patterns:
-            matches = re.findall(pattern, page_content, re.DOTALL)
-            for match in matches:
-                try:
-                    # Try to find video URLs in the matched content
-                    video_patterns = [
-                        r'https://[^"\']*\.mp4[^"\']*',
-                        r'https://v\d*\.pinimg\.com/[^"\']+',
-                    ]
-                    
-                    for video_pattern in video_patterns:
-                        video_matches = re.findall(video_pattern, str(match))
-                        if video_matches:
-                            return video_matches[0]
-                except Exception:
-                    continue
+        # Decode Pinterest's page state once and go straight to the pin's videos
+        return find_video_in_page_state(page_content, pin_id)
     except Exception as e:
-        logging.debug(f"Internal data extraction error: {e}")
+        logging.debug("Internal data extraction error: %s", e)
     return None
 
-def try_mobile_extraction(url):
+def try_mobile_extraction(url, mobile_page=None):
     """Try extracting video using mobile user agent"""
     try:
-        mobile_headers = {
-            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-        }
-        
-        response = requests.get(url, headers=mobile_headers, timeout=10)
-        response.raise_for_status()
+        content = (mobile_page or MobilePage(url)).text
+        if content is None:
+            return None
         
         # Look for mobile-specific video patterns
         patterns = [
@@ -224,24 +314,163 @@ def try_mobile_extraction(url):
         ]
         
         for pattern in patterns:
-            matches = re.findall(pattern, response.text)
+            matches = re.findall(pattern, content)
             if matches:
                 video_url = matches[0].replace('\\u002F', '/').replace('\\', '')
                 if 'http' in video_url:
                     return video_url
     except Exception as e:
-        logging.debug(f"Mobile extraction error: {e}")
+        logging.debug("Mobile extraction error: %s", e)
     return None
 
-def extract_pinterest_metadata(url):
-    """Extract metadata from Pinterest pin page with advanced video detection"""
+class MobilePage:
+    """The pin page as served to a mobile browser, fetched at most once per inspect"""
+    
+    def __init__(self, url):
+        self.url = url
+        self._lock = threading.Lock()
+        self._future = None
+        self._text = None
+    
+    def prefetch(self):
+        """Start fetching in the background unless a fetch is already under way"""
+        with self._lock:
+            if self._future is None:
+                self._future = get_fetch_executor().submit(self._fetch)
+            return self._future
+    
+    def response(self):
+        """Return the mobile response, or None if it could not be fetched"""
+        with self._lock:
+            future = self._future
+            owner = future is None
+            if owner:
+                future = self._future = Future()
+        if owner:
+            future.set_result(self._fetch())
+        return future.result()
+    
+    @property
+    def text(self):
+        if self._text is None:
+            response = self.response()
+            if response is not None:
+                self._text = response.text
+        return self._text
+    
+    def _fetch(self):
+        try:
+            response = http_client.get(self.url, headers=MOBILE_HEADERS, timeout=PAGE_TIMEOUT, allow_redirects=True)
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            logging.debug("Mobile page fetch error: %s", e)
+            return None
+
+def get_fetch_executor():
+    """Return the thread pool used for concurrent upstream page fetches"""
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _fetch_executor_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch')
+    return _fetch_executor
+
+def fetch_pin_page(url, stream=False):
+    """Fetch the desktop pin page, following redirects for pin.it URLs"""
+    response = http_client.get(url, headers=HEADERS, timeout=PAGE_TIMEOUT, allow_redirects=True, stream=stream)
     try:
-        # Follow redirects for pin.it URLs
-        response = requests.get(url, headers=HEADERS, timeout=10, allow_redirects=True)
         response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+    return response
+
+def fetch_pin_page_hedged(url, mobile_page):
+    """Fetch the desktop and mobile pages concurrently; return (response, video_url).
+    
+    If the mobile page answers first and already shows a video, it is used in
+    place of the desktop page. Otherwise the desktop response is returned with
+    no video and the mobile page stays available to the mobile fallbacks.
+    """
+    desktop = get_fetch_executor().submit(fetch_pin_page, url)
+    mobile = mobile_page.prefetch()
+    done, _ = wait([desktop, mobile], return_when=FIRST_COMPLETED)
+    if desktop not in done:
+        video_url = try_mobile_extraction(url, mobile_page) or try_alternative_video_extraction(url, mobile_page)
+        if video_url:
+            logging.info("Mobile page answered first with a video")
+            return mobile_page.response(), video_url
+    
+    try:
+        return desktop.result(), None
+    except requests.RequestException:
+        # The desktop page failed; a mobile page with a video still answers the inspect
+        video_url = try_mobile_extraction(url, mobile_page) or try_alternative_video_extraction(url, mobile_page)
+        if video_url:
+            return mobile_page.response(), video_url
+        raise
+
+def extract_pinterest_metadata(url, hedged=None, use_cache=True):
+    """Extract metadata from Pinterest pin page with advanced video detection"""
+    if hedged is None:
+        hedged = HEDGED_FETCH
+    
+    # Turn pin.it links into their canonical pin URL without fetching any page
+    if is_short_link(url):
+        with STAGE_SECONDS.labels('resolve').time():
+            url = short_link_resolver.resolve(url) or url
+    
+    if not use_cache:
+        return scrape_pinterest_metadata(url, hedged, use_cache=False)
+    
+    # Repeat inspections of a pin are answered from the metadata cache
+    pin_id = extract_pin_id(url)
+    cached = metadata_cache.get(pin_id)
+    if cached is not None:
+        logging.info("Metadata cache hit for %s", url)
+        return cached
+    
+    # Concurrent inspections of the same pin share a single scrape
+    return inspection_flights.do(pin_id, scrape_pinterest_metadata_once, url, pin_id, hedged)
+
+def scrape_pinterest_metadata_once(url, pin_id, hedged):
+    """Scrape a pin unless whoever held the pin's flight before us already cached it"""
+    cached = metadata_cache.peek(pin_id)
+    if cached is not None:
+        logging.info("Metadata cached by a coalesced inspection for %s", url)
+        return cached
+    return scrape_pinterest_metadata(url, hedged)
+
+def scrape_pinterest_metadata(url, hedged, use_cache=True):
+    """Fetch and parse a pin page, caching the result when use_cache is set"""
+    try:
+        # The mobile fallbacks share one lazily fetched mobile page
+        mobile_page = MobilePage(url)
+        video_url = None
+        page = None
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        page_content = response.text
+        # Follow redirects for pin.it URLs
+        with STAGE_SECONDS.labels('fetch').time():
+            if hedged:
+                response, video_url = fetch_pin_page_hedged(url, mobile_page)
+            elif STREAMING_FETCH:
+                # Read only as much of the page as it takes to find the pin's video
+                response = fetch_pin_page(url, stream=True)
+                page = read_pin_page(response, extract_pin_id(response.url))
+                video_url = page.video_url
+            else:
+                response = fetch_pin_page(url)
+        
+        if page is not None:
+            # The page text doubles as the markup, so no bytes copy is kept. With
+            # the video known only <meta> and <title> are read, so only the head
+            # is parsed
+            page_content = page.text
+            document = PageDocument(page_content, page_content, meta_end=page.head_end if video_url else None)
+        else:
+            page_content = response.text
+            document = PageDocument(response.content, page_content)
         
         metadata = {
             'title': None,
@@ -254,16 +483,25 @@ def extract_pinterest_metadata(url):
         
         # Extract pin ID for targeted video search
         pin_id = extract_pin_id(response.url)
-        logging.info(f"Extracted pin ID: {pin_id}")
+        logging.info("Extracted pin ID: %s", pin_id)
+        
+        # One lazy pass over the page serves every regex-based method below
+        scan = PAGE_SCANNER.scan(page_content, pin_id)
         
         # Try multiple advanced video detection methods
-        video_url = detect_pinterest_video(soup, page_content, pin_id, url)
+        if not video_url:
+            with STAGE_SECONDS.labels('detect').time():
+                video_url = detect_pinterest_video(document, page_content, pin_id, url, scan, mobile_page)
         if video_url:
             metadata['video_url'] = video_url
-            logging.info(f"Video found: {video_url}")
+            logging.info("Video found: %s", video_url)
         else:
             logging.info("No video detected - this appears to be an image-only pin")
         
+        # With a video, only <meta> and <title> are read below; without one the
+        # DOM fallbacks need the pruned full tree
+        soup = document.meta_soup if video_url else document.soup
+        
         # Extract title
         title_tag = soup.find('meta', property='og:title') or soup.find('title')
         if title_tag:
@@ -279,170 +517,141 @@ def extract_pinterest_metadata(url):
         if img_tag:
             metadata['image_url'] = img_tag.get('content')
         
-        # Use fallback Open Graph video detection if advanced detection failed
-        if not metadata['video_url']:
-            video_sources = [
-                soup.find('meta', property='og:video'),
-                soup.find('meta', property='og:video:url'),
-                soup.find('meta', property='og:video:secure_url'),
-                soup.find('meta', property='twitter:player:stream'),
-            ]
-            
-            for video_tag in video_sources:
-                if video_tag and video_tag.get('content'):
-                    video_url = video_tag.get('content')
-                    if any(ext in video_url.lower() for ext in ['.mp4', '.webm', '.mov']) or 'video' in video_url.lower():
-                        metadata['video_url'] = video_url
-                        break
-            
-            # Look for video URLs in all script tags
-            if not metadata['video_url']:
-                all_scripts = soup.find_all('script')
-                for script in all_scripts:
-                    if script.string:
-                        import re
-                        # Look for video URL patterns
-                        video_patterns = [
-                            r'"(https?://[^"]*\.mp4[^"]*)"',
-                            r'"(https?://[^"]*\.webm[^"]*)"',
-                            r'"(https?://[^"]*\.mov[^"]*)"',
-                            r'"(https?://[^"]*video[^"]*\.mp4[^"]*)"',
-                            r'"videoUrl":"([^"]+)"',
-                            r'"contentUrl":"([^"]+)"',
-                            r'"video_url":"([^"]+)"'
-                        ]
-                        
-                        for pattern in video_patterns:
-                            matches = re.findall(pattern, script.string, re.IGNORECASE)
-                            for match in matches:
-                                if ('video' in match.lower() or 
-                                    any(ext in match.lower() for ext in ['.mp4', '.webm', '.mov'])):
-                                    metadata['video_url'] = match
-                                    break
-                            if metadata['video_url']:
-                                break
-                        if metadata['video_url']:
-                            break
-        
-        # Pinterest-specific video detection patterns
-        if not metadata['video_url']:
-            # Look for Pinterest video containers and data attributes
-            video_containers = soup.find_all(['div', 'video', 'source'], 
-                                           attrs={'data-test-id': re.compile(r'video', re.I)})
-            for container in video_containers:
-                # Check data attributes
-                for attr in container.attrs:
-                    if 'src' in attr.lower() or 'url' in attr.lower():
-                        value = container.attrs[attr]
-                        if isinstance(value, str) and ('video' in value.lower() or '.mp4' in value.lower()):
-                            metadata['video_url'] = value
-                            break
-                if metadata['video_url']:
-                    break
-        
-        # Enhanced Pinterest video detection using API patterns
-        if not metadata['video_url']:
-            try:
-                # Extract pin ID from URL
-                pin_id_match = re.search(r'/pin/(\d+)', response.url)
-                if pin_id_match:
-                    pin_id = pin_id_match.group(1)
-                    
-                    # Look for Pinterest's internal video API endpoints in page content
-                    page_content = response.text
-                    
-                    # Search for video-related Pinterest CDN URLs
-                    video_cdn_patterns = [
-                        r'(https://v1\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*)',
-                        r'(https://i\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*)',
-                        r'(https://v\d*\.pinimg\.com/[^"\']*\.mp4[^"\']*)',
-                        r'(https://[^"\']*pinterest[^"\']*\.mp4[^"\']*)',
-                        f'(https://[^"\']*{pin_id}[^"\']*\.mp4[^"\']*)'
-                    ]
-                    
-                    for pattern in video_cdn_patterns:
-                        matches = re.findall(pattern, page_content, re.IGNORECASE)
-                        if matches:
-                            # Take the first valid-looking video URL
-                            for match in matches:
-                                if len(match) > 20:  # Filter out very short matches
-                                    metadata['video_url'] = match
-                                    logging.info(f"Found video URL via CDN pattern: {match}")
-                                    break
-                            if metadata['video_url']:
-                                break
-            except Exception as e:
-                logging.debug(f"Pinterest API detection error: {e}")
-        
-        # Trafilatura-based content analysis for video URLs
-        if not metadata['video_url'] and downloaded:
-            try:
-                # Extract raw text content which might contain video URLs
-                text_content = trafilatura.extract(downloaded, include_links=True, include_images=True)
-                if text_content:
-                    # Look for video URLs in extracted content
-                    video_url_patterns = [
-                        r'(https://[^\s]+\.mp4[^\s]*)',
-                        r'(https://[^\s]+\.webm[^\s]*)',
-                        r'(https://[^\s]+\.mov[^\s]*)',
-                        r'(https://v\d*\.pinimg\.com/[^\s]+)',
-                        r'(https://[^\s]*pinterest[^\s]*video[^\s]*)'
-                    ]
-                    
-                    for pattern in video_url_patterns:
-                        matches = re.findall(pattern, text_content, re.IGNORECASE)
-                        if matches:
-                            metadata['video_url'] = matches[0]
-                            logging.info(f"Found video URL via trafilatura: {matches[0]}")
-                            break
-            except Exception as e:
-                logging.debug(f"Trafilatura video detection error: {e}")
-        
         # Extract author/creator info
         author_tag = soup.find('meta', property='og:site_name') or soup.find('meta', attrs={'name': 'author'})
         if author_tag:
             metadata['author'] = author_tag.get('content')
         
-        # Try alternative extraction if no video found
+        # Fallback detection methods when the primary ones found nothing,
+        # ending with a fresh fetch of the page
         if not metadata['video_url']:
-            logging.info("No video found with primary methods, trying alternative extraction...")
-            alternative_video = try_alternative_video_extraction(url)
-            if alternative_video:
-                metadata['video_url'] = alternative_video
+            with STAGE_SECONDS.labels('fallbacks').time():
+                metadata['video_url'] = run_detections('fallback', [
+                    ('og_tags', lambda: find_video_in_og_tags(soup)),
+                    ('script_tags', lambda: find_video_in_script_tags(soup)),
+                    ('video_containers', lambda: find_video_in_containers(soup)),
+                    ('cdn_patterns', lambda: find_video_in_cdn_patterns(page_content, response.url, pin_id, scan)),
+                    ('trafilatura', lambda: find_video_with_trafilatura(page_content)),
+                    ('alternative', lambda: try_alternative_video_extraction(url, mobile_page)),
+                ])
         
         # Log final results
-        logging.info(f"Metadata extraction complete for {url}")
-        logging.info(f"Title: {metadata.get('title', 'N/A')}")
-        logging.info(f"Video URL found: {'Yes' if metadata.get('video_url') else 'No'}")
+        logging.info("Metadata extraction complete for %s", url)
+        logging.info("Title: %s", metadata.get('title', 'N/A'))
+        logging.info("Video URL found: %s", 'Yes' if metadata.get('video_url') else 'No')
         if metadata.get('video_url'):
-            logging.info(f"Video URL: {metadata['video_url']}")
+            logging.info("Video URL: %s", metadata['video_url'])
+        
+        # Key the cache by the pin the redirects ended on, so short links share entries
+        if use_cache:
+            metadata_cache.set(extract_pin_id(response.url), metadata)
         
         return metadata
         
     except requests.RequestException as e:
-        logging.error(f"Request error for {url}: {e}")
+        logging.error("Request error for %s: %s", url, e)
         raise Exception(f"Failed to fetch Pinterest page: {str(e)}")
     except Exception as e:
-        logging.error(f"Parsing error for {url}: {e}")
+        logging.error("Parsing error for %s: %s", url, e)
         raise Exception(f"Failed to parse Pinterest page: {str(e)}")
 
-def try_alternative_video_extraction(url):
+def find_video_in_og_tags(soup):
+    """Look for a video URL in Open Graph and Twitter player meta tags"""
+    video_sources = [
+        soup.find('meta', property='og:video'),
+        soup.find('meta', property='og:video:url'),
+        soup.find('meta', property='og:video:secure_url'),
+        soup.find('meta', property='twitter:player:stream'),
+    ]
+    
+    for video_tag in video_sources:
+        if video_tag and video_tag.get('content'):
+            video_url = video_tag.get('content')
+            if any(ext in video_url.lower() for ext in ['.mp4', '.webm', '.mov']) or 'video' in video_url.lower():
+                return video_url
+    return None
+
+def find_video_in_script_tags(soup):
+    """Look for video URLs in all script tags"""
+    for script in soup.find_all('script'):
+        if script.string:
+            # Look for video URL patterns
+            video_url = SCRIPT_SCANNER.scan(script.string).first('script')
+            if video_url:
+                return video_url
+    return None
+
+def find_video_in_containers(soup):
+    """Look for Pinterest video containers and their data attributes"""
+    video_containers = soup.find_all(['div', 'video', 'source'], 
+                                   attrs={'data-test-id': re.compile(r'video', re.I)})
+    for container in video_containers:
+        # Check data attributes
+        for attr in container.attrs:
+            if 'src' in attr.lower() or 'url' in attr.lower():
+                value = container.attrs[attr]
+                if isinstance(value, str) and ('video' in value.lower() or '.mp4' in value.lower()):
+                    return value
+    return None
+
+def find_video_in_cdn_patterns(page_content, final_url, pin_id, scan):
+    """Enhanced Pinterest video detection using CDN URL patterns"""
+    try:
+        # Extract pin ID from URL
+        pin_id_match = re.search(r'/pin/(\d+)', final_url)
+        if pin_id_match:
+            # Search for video-related Pinterest CDN URLs, reusing the
+            # page scan when it was made for the same pin
+            if pin_id_match.group(1) != pin_id:
+                scan = PAGE_SCANNER.scan(page_content, pin_id_match.group(1))
+            video_url = scan.first('cdn')
+            if video_url:
+                logging.info("Found video URL via CDN pattern: %s", video_url)
+                return video_url
+    except Exception as e:
+        logging.debug("Pinterest API detection error: %s", e)
+    return None
+
+def find_video_with_trafilatura(page_content):
+    """Trafilatura-based content analysis for video URLs"""
+    if not page_content:
+        return None
+    try:
+        # Loaded by the first page that gets this far, which few do
+        import trafilatura
+        
+        # Extract raw text content which might contain video URLs; links come
+        # out as [text](url). Fast mode and the size cap bound the cost
+        text_content = trafilatura.extract(page_content[:TRAFILATURA_MAX_CHARS], fast=True,
+                                           include_links=True, include_images=True)
+        if text_content:
+            # Look for video URLs in extracted content
+            video_url_patterns = [
+                r'(https://[^\s()\[\]"\']+\.mp4[^\s()\[\]"\']*)',
+                r'(https://[^\s()\[\]"\']+\.webm[^\s()\[\]"\']*)',
+                r'(https://[^\s()\[\]"\']+\.mov[^\s()\[\]"\']*)',
+                r'(https://v\d*\.pinimg\.com/[^\s()\[\]"\']+)',
+                r'(https://[^\s()\[\]"\']*pinterest[^\s()\[\]"\']*video[^\s()\[\]"\']*)'
+            ]
+            
+            for pattern in video_url_patterns:
+                matches = re.findall(pattern, text_content, re.IGNORECASE)
+                if matches:
+                    logging.info("Found video URL via trafilatura: %s", matches[0])
+                    return matches[0]
+    except Exception as e:
+        logging.debug("Trafilatura video detection error: %s", e)
+    return None
+
+def try_alternative_video_extraction(url, mobile_page=None):
     """Alternative method to extract video using different approach"""
     try:
-        # Try with different headers to mimic mobile browser
-        mobile_headers = {
-            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_7_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.2 Mobile/15E148 Safari/604.1',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-        }
-        
-        response = requests.get(url, headers=mobile_headers, timeout=10, allow_redirects=True)
-        response.raise_for_status()
+        # Reuse the mobile page fetched for try_mobile_extraction
+        content = (mobile_page or MobilePage(url)).text
+        if content is None:
+            return None
         
         # Look for mobile-specific video patterns
-        content = response.text
         mobile_video_patterns = [
             r'"videoUrl":"([^"]+)"',
             r'"video_url":"([^"]+)"',
@@ -456,13 +665,13 @@ def try_alternative_video_extraction(url):
             if matches:
                 video_url = matches[0].replace('\\u002F', '/').replace('\\', '')
                 if 'http' in video_url and ('.mp4' in video_url or 'video' in video_url):
-                    logging.info(f"Found video URL via mobile extraction: {video_url}")
+                    logging.info("Found video URL via mobile extraction: %s", video_url)
                     return video_url
                     
         return None
         
     except Exception as e:
-        logging.debug(f"Alternative extraction failed: {e}")
+        logging.debug("Alternative extraction failed: %s", e)
         return None
 
 @app.route('/')
@@ -470,31 +679,214 @@ def index():
     """Main page"""
     return render_template('index.html')
 
+def inspect_url(url, prefetch=True):
+    """Inspect one Pinterest URL; return the /inspect payload and its HTTP status"""
+    url = url.strip()
+    
+    if not url:
+        return {'error': 'URL is required'}, 400
+    
+    if not is_valid_pinterest_url(url):
+        return {'error': 'Please provide a valid Pinterest pin URL'}, 400
+    
+    try:
+        with STAGE_SECONDS.labels('inspect').time():
+            metadata = extract_pinterest_metadata(url)
+    except Exception as e:
+        logging.error("Inspection error: %s", e)
+        return {'error': str(e)}, 500
+    
+    if prefetch and metadata.get('video_url') and not video_cache.contains(metadata['video_url']):
+        # A download nearly always follows, so start fetching the video now
+        video_prefetcher.schedule(metadata['video_url'])
+    
+    return {
+        'success': True,
+        'metadata': metadata,
+        'downloadable': bool(metadata.get('video_url'))
+    }, 200
+
+def inspection_key(url):
+    """Identify the pin a URL points to, so a batch inspects each pin once"""
+    url = url.strip()
+    return extract_pin_id(url) or url
+
+def inspect_listed_pin(url):
+    """Inspect a pin of a batch or board; its video is not prefetched, as few videos of bulk inspections get downloaded"""
+    return inspect_url(url, prefetch=False)
+
+def stream_inspections(urls, concurrency):
+    """Inspect URLs on a bounded thread pool, yielding one NDJSON line per URL as results arrive"""
+    groups = {}
+    for index, url in enumerate(urls):
+        groups.setdefault(inspection_key(url), []).append((index, url))
+    
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(groups)), thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(inspect_listed_pin, entries[0][1]): entries for entries in groups.values()}
+        for future in as_completed(futures):
+            payload, status = future.result()
+            # Duplicates of a pin share its result, one line per submitted URL
+            for index, url in futures[future]:
+                yield json.dumps(dict(payload, url=url, index=index, status=status)) + '\n'
+    finally:
+        # Drop queued inspections if the client went away
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def stream_collection_inspections(pin_urls, concurrency, inspect=inspect_listed_pin):
+    """Inspect lazily listed pins on worker threads, yielding one NDJSON line per pin as results arrive.
+
+    The listing, the inspectors and the response are joined by bounded
+    queues, so a board of any size holds only a few pins in memory; the
+    listing pauses whenever the inspectors fall behind.
+    """
+    pending = queue.Queue(maxsize=concurrency * BOARD_QUEUE_DEPTH)
+    results = queue.Queue(maxsize=concurrency * BOARD_QUEUE_DEPTH)
+    stop = threading.Event()
+    done = object()
+    
+    def put(target, item):
+        # Give up once the response is closed instead of blocking forever
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def list_pins():
+        try:
+            for index, url in enumerate(pin_urls):
+                if not put(pending, (index, url)):
+                    break
+        except Exception as e:
+            logging.error("Pin listing error: %s", e)
+            put(results, {'error': f'Listing the pins failed: {e}', 'status': 502})
+        finally:
+            pin_urls.close()
+            for _ in range(concurrency):
+                put(pending, done)
+    
+    def inspect_pins():
+        try:
+            while not stop.is_set():
+                try:
+                    item = pending.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is done:
+                    break
+                index, url = item
+                payload, status = inspect(url)
+                put(results, dict(payload, url=url, pin_id=extract_pin_id(url), index=index, status=status))
+        finally:
+            put(results, done)
+    
+    threads = [threading.Thread(target=list_pins, name='board-list', daemon=True)]
+    threads += [threading.Thread(target=inspect_pins, name=f'board-inspect-{n}', daemon=True)
+                for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = concurrency
+        while running:
+            result = results.get()
+            if result is done:
+                running -= 1
+            else:
+                yield json.dumps(result) + '\n'
+    finally:
+        # Stop listing and inspecting if the client went away
+        stop.set()
+
 @app.route('/inspect', methods=['POST'])
 def inspect_pin():
     """Inspect Pinterest pin and return metadata"""
     try:
         data = request.get_json()
-        url = data.get('url', '').strip()
+        payload, status = inspect_url(data.get('url', ''))
+        return jsonify(payload), status
         
-        if not url:
-            return jsonify({'error': 'URL is required'}), 400
+    except Exception as e:
+        logging.error("Inspection error: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/inspect/batch', methods=['POST'])
+def inspect_batch():
+    """Inspect many Pinterest pins concurrently, streaming results as NDJSON"""
+    try:
+        data = request.get_json()
+        urls = data.get('urls')
+        
+        if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+            return jsonify({'error': 'A non-empty list of URLs is required'}), 400
         
-        if not is_valid_pinterest_url(url):
-            return jsonify({'error': 'Please provide a valid Pinterest pin URL'}), 400
+        if len(urls) > BATCH_MAX_URLS:
+            return jsonify({'error': f'At most {BATCH_MAX_URLS} URLs can be inspected per batch'}), 400
         
-        metadata = extract_pinterest_metadata(url)
+        concurrency = data.get('concurrency', BATCH_CONCURRENCY)
+        if not isinstance(concurrency, int) or concurrency < 1:
+            return jsonify({'error': 'Concurrency must be a positive integer'}), 400
+        concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
         
-        return jsonify({
-            'success': True,
-            'metadata': metadata,
-            'downloadable': bool(metadata.get('video_url'))
-        })
+        return Response(stream_inspections(urls, concurrency), mimetype='application/x-ndjson')
         
     except Exception as e:
-        logging.error(f"Inspection error: {e}")
+        logging.error("Batch inspection error: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/inspect/board', methods=['POST'])
+def inspect_board():
+    """Inspect every pin of a Pinterest board or profile concurrently, streaming results as NDJSON"""
+    try:
+        data = request.get_json()
+        url = data.get('url', '')
+        collection = parse_collection_url(url.strip()) if isinstance(url, str) else None
+        
+        if collection is None:
+            return jsonify({'error': 'Please provide a valid Pinterest board or profile URL'}), 400
+        
+        limit = data.get('limit')
+        if limit is not None and (not isinstance(limit, int) or limit < 1):
+            return jsonify({'error': 'Limit must be a positive integer'}), 400
+        
+        concurrency = data.get('concurrency', BATCH_CONCURRENCY)
+        if not isinstance(concurrency, int) or concurrency < 1:
+            return jsonify({'error': 'Concurrency must be a positive integer'}), 400
+        concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+        
+        try:
+            # Resolved before the response starts, so an unknown board is a 404 rather than an error line
+            pin_urls = pin_lister.iter_pins(collection, limit)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except requests.RequestException as e:
+            logging.error("Board lookup error for %s: %s", url, e)
+            return jsonify({'error': f'Failed to fetch Pinterest board: {e}'}), 502
+        return Response(stream_collection_inspections(pin_urls, concurrency), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        logging.error("Board inspection error: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose this worker's metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/detection')
+def detection_order():
+    """Show the current detection method order and the stats behind it"""
+    return jsonify(detection_scheduler.snapshot())
+
+def download_filename(filename):
+    """Sanitize a user-supplied download filename"""
+    filename = re.sub(r'[^\w\-_\.]', '_', filename)
+    if not filename.endswith(('.mp4', '.webm', '.mov', '.avi')):
+        filename += '.mp4'
+    return filename
+
 @app.route('/download')
 def download_video():
     """Stream video file to user"""
@@ -505,37 +897,65 @@ def download_video():
         if not video_url:
             return jsonify({'error': 'Video URL is required'}), 400
         
-        # Sanitize filename
-        filename = re.sub(r'[^\w\-_\.]', '_', filename)
-        if not filename.endswith(('.mp4', '.webm', '.mov', '.avi')):
-            filename += '.mp4'
+        filename = download_filename(filename)
+        
+        cached = video_cache.get(video_url)
+        if cached is not None:
+            return send_cached(cached, request, filename)
+        
+        fill = None
+        if video_cache.enabled:
+            def fill(length, response_headers, chunks):
+                if not video_cache.can_store(length):
+                    return chunks
+                return video_cache.tee(video_url, length, response_headers, chunks)
+        
+        prefetched = video_prefetcher.take(video_url) if is_plain_download(request) else None
+        if prefetched is not None:
+            return segmented_response(prefetched, filename, fill=fill, source='prefetch')
         
-        # Stream the video file
+        # Stream the video file, letting the CDN answer range and conditional requests
         try:
-            response = requests.get(video_url, headers=HEADERS, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            def generate():
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        yield chunk
+            headers = upstream_headers(HEADERS, request.headers)
+            download = None
+            if request.method == 'HEAD':
+                response = http_client.head(video_url, headers=headers, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+            elif SEGMENTED_DOWNLOAD and is_plain_download(request):
+                # Falls back to the single upstream response when ranges are not served
+                download, response = segmented_fetcher.open(video_url, headers)
+            else:
+                response = http_client.get(video_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            if response is not None and response.status_code != 416:
+                response.raise_for_status()
             
-            return Response(
-                generate(),
-                mimetype='video/mp4',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{filename}"',
-                    'Content-Type': 'video/mp4'
-                }
-            )
+            if download is not None:
+                return segmented_response(download, filename, fill=fill)
+            return proxy_response(response, request, filename, fill=fill)
             
         except requests.RequestException as e:
-            logging.error(f"Download error: {e}")
+            logging.error("Download error: %s", e)
             return jsonify({'error': 'Failed to download video. The video may be protected or unavailable.'}), 500
             
     except Exception as e:
-        logging.error(f"Download error: {e}")
+        logging.error("Download error: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def preload_parsers():
+    """Import the HTML parsers every inspection uses, which otherwise load with the first parse"""
+    import bs4  # noqa: F401
+    import tag_filters  # noqa: F401
+
+def create_app():
+    """Return the WSGI app, ready to be loaded once and forked into workers.
+
+    With `gunicorn --preload 'main:create_app()'` this runs in the master:
+    the parsers are imported there so that workers share them copy-on-write,
+    and everything loaded so far is moved out of the garbage collector's
+    reach, as its passes would write to those pages and copy them per worker.
+    """
+    preload_parsers()
+    gc.freeze()
+    return app
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
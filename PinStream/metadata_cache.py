@@ -0,0 +1,182 @@
+"""Pin-ID keyed cache for extracted pin metadata"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Entries kept in memory per worker; 0 disables the cache
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", "2048"))
+# Seconds a pin with a video stays cached, and a pin without one
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", "3600"))
+METADATA_CACHE_NEGATIVE_TTL = float(os.environ.get("METADATA_CACHE_NEGATIVE_TTL", "300"))
+# SQLite file shared by all workers on the host; unset keeps the cache in memory
+METADATA_CACHE_DB = os.environ.get("METADATA_CACHE_DB", "")
+
+
+class SQLiteBackend:
+    """Metadata store in a SQLite file, shared between worker processes"""
+
+    # Prune expired rows once every this many writes
+    PRUNE_EVERY = 256
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect()
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute(
+                'CREATE TABLE IF NOT EXISTS pin_metadata ('
+                'pin_id TEXT PRIMARY KEY, metadata TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            local.pid = os.getpid()
+        return local.connection
+
+    def get(self, pin_id):
+        """Return (metadata, expires_at) for a live entry, or None"""
+        row = self._connect().execute(
+            'SELECT metadata, expires_at FROM pin_metadata WHERE pin_id = ? AND expires_at > ?',
+            (pin_id, time.time()),
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, pin_id, metadata, expires_at):
+        connection = self._connect()
+        connection.execute(
+            'INSERT OR REPLACE INTO pin_metadata (pin_id, metadata, expires_at) VALUES (?, ?, ?)',
+            (pin_id, json.dumps(metadata), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            connection.execute('DELETE FROM pin_metadata WHERE expires_at <= ?', (time.time(),))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM pin_metadata')
+
+
+class MetadataCache:
+    """In-memory LRU of pin metadata with per-entry TTLs and an optional shared backend.
+
+    Pins without a video are kept for negative_ttl seconds instead of ttl, so a
+    pin that gains a video, or a transient miss, is retried sooner.
+    """
+
+    def __init__(self, maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL,
+                 negative_ttl=METADATA_CACHE_NEGATIVE_TTL, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backend_hits = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, pin_id):
+        """Return a copy of the cached metadata for pin_id, or None"""
+        if not self.enabled:
+            return None
+        if pin_id:
+            metadata = self._lookup(pin_id)
+            if metadata is not None:
+                return metadata
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def peek(self, pin_id):
+        """Like get, but a miss is not counted; for re-checking after waiting on other work"""
+        if not self.enabled or not pin_id:
+            return None
+        return self._lookup(pin_id)
+
+    def _lookup(self, pin_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(pin_id)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(pin_id)
+                    self.hits += 1
+                    return dict(entry[0])
+                del self._entries[pin_id]
+
+        if self.backend is not None:
+            try:
+                stored = self.backend.get(pin_id)
+            except Exception as e:
+                logging.debug("Metadata cache backend read error: %s", e)
+                stored = None
+            if stored is not None:
+                with self._lock:
+                    self._store(pin_id, stored[0], stored[1])
+                    self.hits += 1
+                    self.backend_hits += 1
+                return dict(stored[0])
+        return None
+
+    def set(self, pin_id, metadata):
+        """Cache metadata for pin_id with the TTL matching whether it has a video"""
+        if not self.enabled or not pin_id:
+            return
+        ttl = self.ttl if metadata.get('video_url') else self.negative_ttl
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        metadata = dict(metadata)
+        with self._lock:
+            self._store(pin_id, metadata, expires_at)
+        if self.backend is not None:
+            try:
+                self.backend.set(pin_id, metadata, expires_at)
+            except Exception as e:
+                logging.debug("Metadata cache backend write error: %s", e)
+
+    def _store(self, pin_id, metadata, expires_at):
+        self._entries[pin_id] = (metadata, expires_at)
+        self._entries.move_to_end(pin_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current in-memory size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'backend_hits': self.backend_hits,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
+
+def create_metadata_cache():
+    """Build the process-wide cache from the METADATA_CACHE_* settings"""
+    backend = None
+    if METADATA_CACHE_DB and METADATA_CACHE_SIZE > 0:
+        try:
+            backend = SQLiteBackend(METADATA_CACHE_DB)
+        except sqlite3.Error as e:
+            logging.warning("Metadata cache database unavailable, using memory only: %s", e)
+    return MetadataCache(backend=backend)
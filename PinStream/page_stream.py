@@ -0,0 +1,147 @@
+"""Incremental reading of pin pages that stops once the pin's video is certain"""
+import codecs
+import json
+import logging
+import os
+import re
+
+from metrics import Counter
+from pin_data import find_pinned_video, find_video_in_json_ld
+
+# Opt-in: read pin pages in chunks and stop as soon as the pin's video is found
+STREAMING_FETCH = os.environ.get("STREAMING_FETCH", "false").lower() in ('1', 'true', 'yes')
+# Decoded page bytes read before the rest of a page is dropped
+MAX_PAGE_BYTES = int(os.environ.get("MAX_PAGE_BYTES", str(8 * 1024 ** 2)))
+# Bytes read from the connection per iteration
+PAGE_CHUNK_SIZE = int(os.environ.get("PAGE_CHUNK_SIZE", "65536"))
+
+PAGE_READS = Counter('pinstream_page_reads_total', 'Streamed pin page reads by how they ended', ['outcome'])
+PAGE_BYTES = Counter('pinstream_page_bytes_total', 'Decoded pin page bytes read by streamed fetches')
+
+# Where a block that can name the pin's video starts: a JSON-LD script, or
+# the page state as a JSON <script id=...> tag or a JS assignment
+BLOCK_START = re.compile(
+    r'<script[^>]*\btype=["\']application/ld\+json["\'][^>]*>'
+    r'|<script[^>]*\bid=["\'](?:__PWS_DATA__|__INITIAL_STATE__)["\'][^>]*>\s*(?={)'
+    r'|window\.(?:__PWS_DATA__|__INITIAL_STATE__)\s*=\s*(?={)'
+)
+BLOCK_END = '</script>'
+HEAD_END = '</head>'
+
+# Characters kept from a chunk with no block start, in case one is split
+# across chunks
+START_OVERLAP = 512
+
+
+class VideoWatcher:
+    """Spot the pin's video in page text fed piece by piece.
+
+    Only complete blocks are checked: JSON-LD scripts and the page state,
+    where only the pin's own video_list counts. Like the detection chain,
+    which reads structured data first, JSON-LD wins: a video found in the
+    page state is held back until the head has ended, in case a JSON-LD
+    script in the head names another. JSON-LD further down the body is not
+    waited for. Text outside those blocks is not kept.
+    """
+
+    def __init__(self, pin_id):
+        self.pin_id = pin_id
+        self._buffer = ''
+        self._block = None
+        self._tail = ''
+        self.head_ended = False
+        # Video found in the page state, returned once no JSON-LD can precede it
+        self.held = None
+
+    def feed(self, text):
+        """Add the next piece of the page; return the video URL once known"""
+        if not self.head_ended:
+            # Checked across pieces, since </head> can be split between two
+            self.head_ended = HEAD_END in self._tail + text
+            self._tail = (self._tail + text)[-len(HEAD_END) + 1:]
+        self._buffer += text
+        while True:
+            if self._block is None:
+                match = BLOCK_START.search(self._buffer)
+                if match is None:
+                    self._buffer = self._buffer[-START_OVERLAP:]
+                    break
+                self._block = 'json_ld' if 'ld+json' in match.group(0) else 'state'
+                self._buffer = self._buffer[match.end():]
+            end = self._buffer.find(BLOCK_END)
+            if end == -1:
+                break
+            block, self._buffer = self._buffer[:end], self._buffer[end + len(BLOCK_END):]
+            kind, self._block = self._block, None
+            video_url = self._check(kind, block)
+            if video_url and kind == 'json_ld':
+                return video_url
+            if video_url and self.held is None:
+                self.held = video_url
+        return self.held if self.head_ended else None
+
+    def _check(self, kind, block):
+        if kind == 'state':
+            return find_pinned_video(block, 0, self.pin_id) if self.pin_id else None
+        try:
+            return find_video_in_json_ld(json.loads(block))
+        except ValueError:
+            return None
+
+
+class StreamedPage:
+    """The part of a pin page read before a video was found or the size cap was hit"""
+
+    def __init__(self, url, text, video_url, outcome):
+        self.url = url
+        self.text = text
+        self.video_url = video_url
+        self.outcome = outcome
+
+    @property
+    def head_end(self):
+        """Offset just past </head>, or None if the head was not read in full"""
+        end = self.text.find('</head>')
+        return None if end == -1 else end + len('</head>')
+
+
+def read_pin_page(response, pin_id, max_bytes=MAX_PAGE_BYTES, chunk_size=PAGE_CHUNK_SIZE):
+    """Read a streamed pin page response in chunks and close it.
+
+    Reading stops once the pin's video turns up (outcome 'early'), or after
+    max_bytes of decoded page (outcome 'truncated'); otherwise the whole page
+    is read ('complete'). Only the decoded text is kept.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    watcher = VideoWatcher(pin_id)
+    pieces = []
+    read = 0
+    video_url = None
+    outcome = 'complete'
+    try:
+        for chunk in response.iter_content(chunk_size):
+            if read + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - read]
+                outcome = 'truncated'
+            read += len(chunk)
+            piece = decoder.decode(chunk)
+            pieces.append(piece)
+            video_url = watcher.feed(piece)
+            if video_url:
+                outcome = 'early'
+                break
+            if outcome == 'truncated':
+                logging.warning("Pin page %s is over %s bytes; reading only the start", response.url, max_bytes)
+                break
+        else:
+            pieces.append(decoder.decode(b'', final=True))
+    finally:
+        response.close()
+    if not video_url and watcher.held:
+        # The page ended, or was cut off, inside the head; no JSON-LD came before the state
+        video_url = watcher.held
+
+    PAGE_READS.labels(outcome).inc()
+    PAGE_BYTES.inc(read)
+    logging.debug("Read %s bytes of %s (%s)", read, response.url, outcome)
+    return StreamedPage(response.url, ''.join(pieces), video_url, outcome)
@@ -0,0 +1,194 @@
+"""Targeted extraction of video URLs from Pinterest's embedded page state"""
+import json
+import re
+
+# Global names Pinterest assigns its page state to, in lookup order
+STATE_BLOB_NAMES = ['__PWS_DATA__', '__INITIAL_STATE__']
+
+# Where each state blob starts: a JS assignment or a JSON <script id=...> tag
+STATE_BLOB_STARTS = {
+    name: re.compile(
+        rf'window\.{name}\s*=\s*(?={{)'
+        rf'|<script[^>]*\bid=["\']{name}["\'][^>]*>\s*(?={{)'
+    )
+    for name in STATE_BLOB_NAMES
+}
+
+# Loose video fragments outside a recognised state blob
+FRAGMENT_PATTERNS = [
+    re.compile(r'"videos":\s*\[([^\]]+)\]'),
+    re.compile(r'"video":\s*({[^}]+})'),
+]
+
+MP4_URL_PATTERN = re.compile(r'https://[^"\']*\.mp4[^"\']*')
+PINIMG_URL_PATTERN = re.compile(r'https://v\d*\.pinimg\.com/[^"\']+')
+
+# Tokens that matter when matching braces by hand: strings (which may hold
+# braces) and the braces themselves
+BRACE_TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[{}]', re.DOTALL)
+
+_decoder = json.JSONDecoder()
+
+
+def find_video_in_page_state(page_content, pin_id):
+    """Find the pin's video URL in the embedded page state, or in loose video fragments"""
+    for name in STATE_BLOB_NAMES:
+        for match in STATE_BLOB_STARTS[name].finditer(page_content):
+            video_url = find_video_in_state_blob(page_content, match.end(), pin_id)
+            if video_url:
+                return video_url
+
+    for pattern in FRAGMENT_PATTERNS:
+        for match in pattern.finditer(page_content):
+            video_url = find_video_in_text(match.group(1))
+            if video_url:
+                return video_url
+    return None
+
+
+def find_video_in_json_ld(data):
+    """Return the video URL named by a decoded JSON-LD object, or None"""
+    if not isinstance(data, dict):
+        return None
+    # Look for video-related fields
+    for key in ['contentUrl', 'embedUrl', 'videoUrl', 'url']:
+        if key in data and isinstance(data[key], str):
+            if '.mp4' in data[key] or 'video' in data[key].lower():
+                return data[key]
+
+    # Check nested objects
+    if 'video' in data and isinstance(data['video'], dict):
+        video_obj = data['video']
+        for key in ['contentUrl', 'embedUrl', 'url']:
+            if key in video_obj:
+                return video_obj[key]
+    return None
+
+
+def find_pinned_video(page_content, start, pin_id):
+    """Return the video of pin_id itself from the state object starting at start, or None.
+
+    Unlike find_video_in_state_blob there is no fallback to other URLs in the
+    state, so a hit is known to be this pin's video.
+    """
+    try:
+        state, _ = _decoder.raw_decode(page_content, start)
+    except ValueError:
+        return None
+    pin = find_pin_node(state, pin_id)
+    video_list = find_video_list(pin) if pin is not None else None
+    return pick_video_url(video_list) if video_list else None
+
+
+def find_video_in_state_blob(page_content, start, pin_id):
+    """Decode the state object starting at start once and look up the pin's video"""
+    try:
+        state, _ = _decoder.raw_decode(page_content, start)
+    except ValueError:
+        # Not strict JSON (e.g. a JS literal); fall back to scanning its text
+        end = find_matching_brace(page_content, start)
+        return find_video_in_text(page_content[start:end]) if end else None
+
+    pin = find_pin_node(state, pin_id)
+    if pin is not None:
+        video_list = find_video_list(pin)
+        if video_list:
+            video_url = pick_video_url(video_list)
+            if video_url:
+                return video_url
+    return find_video_in_values(state)
+
+
+def find_matching_brace(text, start):
+    """Return the index just past the brace closing the one at start, or None"""
+    depth = 0
+    for token in BRACE_TOKEN_PATTERN.finditer(text, start):
+        value = token.group(0)
+        if value == '{':
+            depth += 1
+        elif value == '}':
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    return None
+
+
+def find_pin_node(state, pin_id):
+    """Return the decoded object describing pin_id, or None"""
+    if not pin_id:
+        return None
+    # Fast path: the redux store keys pins by ID
+    try:
+        pin = state['props']['initialReduxState']['pins'][pin_id]
+        if isinstance(pin, dict):
+            return pin
+    except (KeyError, TypeError):
+        pass
+
+    for node in iter_json(state):
+        if isinstance(node, dict) and str(node.get('id')) == pin_id:
+            return node
+    return None
+
+
+def find_video_list(node):
+    """Return the first non-empty 'video_list' mapping under node"""
+    for child in iter_json(node):
+        if isinstance(child, dict):
+            video_list = child.get('video_list')
+            if isinstance(video_list, dict) and video_list:
+                return video_list
+    return None
+
+
+def pick_video_url(video_list):
+    """Pick the widest progressive MP4 variant from a Pinterest video_list"""
+    best_url, best_width = None, -1
+    for variant in video_list.values():
+        if not isinstance(variant, dict):
+            continue
+        url = variant.get('url')
+        if not isinstance(url, str) or '.mp4' not in url.lower():
+            continue
+        width = variant.get('width')
+        width = width if isinstance(width, (int, float)) else 0
+        if width > best_width:
+            best_url, best_width = url, width
+    return best_url
+
+
+def find_video_in_values(state):
+    """Return the first MP4 URL among the decoded string values, else the first pinimg one"""
+    pinimg_url = None
+    for value in iter_json(state):
+        if not isinstance(value, str) or 'https://' not in value:
+            continue
+        match = MP4_URL_PATTERN.search(value)
+        if match:
+            return match.group(0)
+        if pinimg_url is None:
+            match = PINIMG_URL_PATTERN.search(value)
+            if match:
+                pinimg_url = match.group(0)
+    return pinimg_url
+
+
+def find_video_in_text(text):
+    """Return the first MP4 URL in raw text, else the first pinimg one"""
+    for pattern in (MP4_URL_PATTERN, PINIMG_URL_PATTERN):
+        match = pattern.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+
+def iter_json(node):
+    """Yield every object, array and scalar of a decoded JSON tree in document order"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, dict):
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
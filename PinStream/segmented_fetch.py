@@ -0,0 +1,195 @@
+"""Parallel byte-range fetching of large upstream videos, streamed back in order"""
+import logging
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+from http_client import DOWNLOAD_TIMEOUT
+
+# Opt-in: fetch /download bodies as concurrent byte ranges
+SEGMENTED_DOWNLOAD = os.environ.get("SEGMENTED_DOWNLOAD", "false").lower() in ('1', 'true', 'yes')
+# Bytes per range request; each in-flight segment is buffered whole in memory
+SEGMENT_SIZE = int(os.environ.get("SEGMENT_SIZE", str(4 * 1024 ** 2)))
+# Segments fetched or buffered ahead of the client per download
+SEGMENT_CONCURRENCY = int(os.environ.get("SEGMENT_CONCURRENCY", "4"))
+# Threads shared by every segmented download in the process
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", "32"))
+# Extra attempts for a failed segment before the download is aborted
+SEGMENT_RETRIES = int(os.environ.get("SEGMENT_RETRIES", "1"))
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class SegmentError(Exception):
+    """An upstream range response that does not fit the download it belongs to"""
+
+
+def parse_content_range(value):
+    """Return (first, last, total) from a Content-Range header; total is None if unknown"""
+    match = CONTENT_RANGE_PATTERN.fullmatch((value or '').strip())
+    if match is None:
+        return None
+    first, last, total = match.groups()
+    return int(first), int(last), None if total == '*' else int(total)
+
+
+class SegmentedDownload:
+    """A video body fetched as SEGMENT_SIZE ranges, at most `window` at a time.
+
+    Segments are requested only as the client consumes earlier ones, so a slow
+    client holds back the fetching instead of having the file buffered.
+    """
+
+    def __init__(self, fetcher, url, headers, first, length, response_headers):
+        self.fetcher = fetcher
+        self.url = url
+        self.headers = headers
+        self.first = first
+        self.length = length
+        self.response_headers = response_headers
+
+    def segments(self):
+        """Yield the (start, stop) of every segment after the first"""
+        for start in range(len(self.first), self.length, self.fetcher.segment_size):
+            yield start, min(start + self.fetcher.segment_size, self.length)
+
+    def iter_chunks(self, chunk_size):
+        fetcher = self.fetcher
+        pending = deque()
+        remaining = self.segments()
+        try:
+            for start, stop in remaining:
+                pending.append(fetcher.submit(self.url, self.headers, start, stop))
+                if len(pending) >= fetcher.window:
+                    break
+            yield from _split(self.first, chunk_size)
+            self.first = b''
+
+            while pending:
+                data = pending.popleft().result()
+                # Keep the window full while this segment goes out
+                for start, stop in remaining:
+                    pending.append(fetcher.submit(self.url, self.headers, start, stop))
+                    break
+                yield from _split(data, chunk_size)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _split(data, chunk_size):
+    view = memoryview(data)
+    for offset in range(0, len(data), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+
+
+class SegmentedFetcher:
+    """Probe and fetch videos as concurrent byte ranges on a shared thread pool"""
+
+    def __init__(self, segment_size=SEGMENT_SIZE, window=SEGMENT_CONCURRENCY,
+                 workers=SEGMENT_WORKERS, retries=SEGMENT_RETRIES):
+        self.segment_size = segment_size
+        self.window = max(window, 1)
+        self.workers = workers
+        self.retries = retries
+        self._executor = None
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.fallbacks = 0
+        self.segments = 0
+        self.retried = 0
+
+    def get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='segment')
+        return self._executor
+
+    def after_fork(self):
+        """Forget a parent process's thread pool, whose threads do not exist in a forked child"""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def open(self, url, headers):
+        """Request the first segment of url.
+
+        Returns (download, None) when the upstream serves ranges, or
+        (None, response) with the upstream's own response to stream as usual,
+        also when the first range comes back short.
+        """
+        # Ranges must cover the stored bytes, so ask for no content coding
+        headers = dict(headers, **{'Accept-Encoding': 'identity'})
+        response = http_client.get(url, headers=dict(headers, Range=f'bytes=0-{self.segment_size - 1}'),
+                                   stream=True, timeout=DOWNLOAD_TIMEOUT)
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        if (response.status_code != 206 or content_range is None or content_range[0] != 0
+                or content_range[2] is None or 'Content-Encoding' in response.headers):
+            if response.status_code in (206, 416):
+                # Ranges we cannot use (or an empty file): fetch it the plain way
+                response.close()
+                response = http_client.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            with self._lock:
+                self.fallbacks += 1
+            return None, response
+
+        try:
+            first = response.content
+        finally:
+            response.close()
+        length = content_range[2]
+        if len(first) != content_range[1] + 1:
+            # A probe that does not add up degrades to the plain single stream
+            logging.debug("Short first segment of %s: %s bytes for %s", url, len(first), content_range)
+            with self._lock:
+                self.fallbacks += 1
+            return None, http_client.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # A changed video answers 200 to later segments instead of mixing versions
+            headers['If-Range'] = etag
+        response_headers = {name: response.headers[name] for name in ('ETag', 'Last-Modified')
+                            if name in response.headers}
+        with self._lock:
+            self.downloads += 1
+        return SegmentedDownload(self, url, headers, first, length, response_headers), None
+
+    def submit(self, url, headers, start, stop):
+        return self.get_executor().submit(self.fetch_segment, url, headers, start, stop)
+
+    def fetch_segment(self, url, headers, start, stop):
+        """Return bytes [start, stop) of url, retrying up to `retries` times"""
+        headers = dict(headers, Range=f'bytes={start}-{stop - 1}')
+        for attempt in range(self.retries + 1):
+            try:
+                response = http_client.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+                content_range = parse_content_range(response.headers.get('Content-Range'))
+                if response.status_code != 206 or content_range is None or content_range[:2] != (start, stop - 1):
+                    raise SegmentError(f"expected bytes {start}-{stop - 1}, got {response.status_code} "
+                                       f"{response.headers.get('Content-Range')}")
+                if len(response.content) != stop - start:
+                    raise SegmentError(f"short segment {start}-{stop - 1}: {len(response.content)} bytes")
+                with self._lock:
+                    self.segments += 1
+                return response.content
+            except (requests.RequestException, SegmentError) as e:
+                if attempt == self.retries:
+                    raise
+                logging.debug("Retrying segment %s-%s of %s: %s", start, stop - 1, url, e)
+                with self._lock:
+                    self.retried += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'downloads': self.downloads,
+                'fallbacks': self.fallbacks,
+                'segments': self.segments,
+                'retried': self.retried,
+            }
@@ -0,0 +1,109 @@
+"""Cheap resolution of pin.it short links to canonical pin URLs"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import http_client
+
+SHORT_LINK_HOSTS = {'pin.it'}
+PINTEREST_ORIGIN = 'https://www.pinterest.com'
+
+# Resolved short codes kept per worker, and for how many seconds
+SHORT_LINK_CACHE_SIZE = int(os.environ.get("SHORT_LINK_CACHE_SIZE", "4096"))
+SHORT_LINK_TTL = float(os.environ.get("SHORT_LINK_TTL", "86400"))
+
+PIN_PATH_PATTERN = re.compile(r'/pin/(\d+)')
+
+
+def is_short_link(url):
+    """Check if URL is a pin.it short link"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return urlparse(url).netloc.lower() in SHORT_LINK_HOSTS
+
+
+def short_code(url):
+    """Return the case-sensitive code identifying a short link"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return urlparse(url).path.strip('/')
+
+
+def canonical_pin_url(pin_id, origin=PINTEREST_ORIGIN):
+    return f"{origin}/pin/{pin_id}/"
+
+
+class ShortLinkResolver:
+    """Resolve short links with bodiless requests and remember where they lead"""
+
+    def __init__(self, headers=None, maxsize=SHORT_LINK_CACHE_SIZE, ttl=SHORT_LINK_TTL, origin=PINTEREST_ORIGIN):
+        self.headers = headers
+        # Site the canonical pin URLs point to
+        self.origin = origin
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, url):
+        """Return the canonical pin URL for a short link without network I/O, or None"""
+        code = short_code(url)
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(code)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(code, None)
+            self.misses += 1
+        return None
+
+    def resolve(self, url):
+        """Return the canonical pin URL a short link redirects to, or None"""
+        canonical = self.cached(url)
+        if canonical:
+            return canonical
+
+        try:
+            final_url = self._follow(url)
+        except Exception as e:
+            logging.debug("Short link resolution error for %s: %s", url, e)
+            return None
+
+        pin_id_match = PIN_PATH_PATTERN.search(final_url)
+        if not pin_id_match:
+            logging.debug("Short link %s did not lead to a pin: %s", url, final_url)
+            return None
+
+        canonical = canonical_pin_url(pin_id_match.group(1), self.origin)
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[short_code(url)] = (canonical, time.time() + self.ttl)
+                self._entries.move_to_end(short_code(url))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return canonical
+
+    def _follow(self, url):
+        """Follow the redirect chain without downloading the final page"""
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        response = http_client.head(url, headers=self.headers, allow_redirects=True)
+        response.close()
+        if response.status_code < 400 and PIN_PATH_PATTERN.search(response.url):
+            return response.url
+
+        # Some hops refuse HEAD; follow them with a GET that never reads the body
+        response = http_client.get(url, headers=self.headers, allow_redirects=True, stream=True)
+        response.close()
+        return response.url
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
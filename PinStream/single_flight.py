@@ -0,0 +1,111 @@
+"""Request coalescing: one in-flight call per key, shared by concurrent callers"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Directory for cross-process lock files; unset coalesces within a worker only
+SINGLE_FLIGHT_LOCK_DIR = os.environ.get("SINGLE_FLIGHT_LOCK_DIR", "")
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result or error.
+
+    With a lock_dir, the caller doing the work also holds a lock file of its
+    own key, so the same key is worked on by one process at a time. The call
+    should then check a cache shared between processes before doing any work
+    itself. Lock files are removed when released, so the directory only holds
+    the keys in flight.
+    """
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_LOCK_DIR):
+        self.lock_dir = lock_dir if fcntl is not None else ''
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.flights = 0
+        self.coalesced = 0
+        self.process_waits = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs), or wait for the call already running for key"""
+        if key is None:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.flights += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logging.debug("Joining in-flight call for %s", key)
+            return call.result()
+
+        try:
+            with self._process_lock(key):
+                result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    @contextmanager
+    def _process_lock(self, key):
+        if not self.lock_dir:
+            yield
+            return
+
+        path = os.path.join(self.lock_dir, hashlib.sha256(str(key).encode()).hexdigest()[:32] + '.lock')
+        while True:
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker process is on this key; wait for it
+                with self._lock:
+                    self.process_waits += 1
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                break
+            # The holder we waited for removed this file; lock the one at path now
+            lock_file.close()
+        try:
+            yield
+        finally:
+            # Removed while still locked, so a waiter on this file sees it is stale
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.debug("Could not remove %s: %s", path, e)
+            lock_file.close()
+
+    def stats(self):
+        """Return how many calls ran and how many callers joined one already running"""
+        with self._lock:
+            return {
+                'flights': self.flights,
+                'coalesced': self.coalesced,
+                'process_waits': self.process_waits,
+                'in_flight': len(self._calls),
+            }
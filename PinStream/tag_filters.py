@@ -0,0 +1,42 @@
+"""bs4 tag filters pruning pin page trees to what detection reads; imported by the first parse"""
+from bs4.filter import ElementFilter
+
+
+def default_parser():
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+# Tree builder used unless HTML_PARSER is set; lxml is much faster
+DEFAULT_PARSER = default_parser()
+
+
+class TagFilter(ElementFilter):
+    """Build only the named tags, tags carrying one of the attributes, and everything inside them"""
+
+    def __init__(self, names, attrs=()):
+        super().__init__()
+        self.names = frozenset(names)
+        self.attrs = tuple(attrs)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if name in self.names:
+            return True
+        return bool(attrs) and any(attr in attrs for attr in self.attrs)
+
+    def allow_string_creation(self, string):
+        # Only reached for text outside every kept tag
+        return False
+
+
+# What the metadata fields read: <meta> and <title>
+META_FILTER = TagFilter(['meta', 'title'])
+
+# Everything any DOM-based detection method reads
+DETECTION_FILTER = TagFilter(
+    ['meta', 'title', 'script', 'video', 'source'],
+    ['data-video-url', 'data-src', 'data-content-url', 'data-test-id'],
+)
@@ -0,0 +1,40 @@
+"""Board lookups against a stubbed resource API; run with `python -m pytest` from the PinStream directory"""
+import pytest
+
+import board_listing
+import main
+from benchmarks.stub_server import StubServer
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with StubServer() as server:
+        # Let the stub stand in for pinterest.com
+        monkeypatch.setattr(board_listing, 'COLLECTION_HOSTS', {server.base_url.split('://', 1)[1]})
+        yield server
+
+
+def board_url(server):
+    return f"{server.base_url}/nobody/no-such-board/"
+
+
+def test_unknown_board_raises_lookup_error(server):
+    collection = board_listing.parse_collection_url(board_url(server))
+
+    with pytest.raises(LookupError):
+        board_listing.PinLister().board_id(collection)
+
+
+def test_inspect_board_answers_404_for_unknown_board(server):
+    response = main.app.test_client().post('/inspect/board', json={'url': board_url(server)})
+
+    assert response.status_code == 404
+    assert 'nobody/no-such-board' in response.get_json()['error']
+
+
+def test_inspect_board_answers_502_when_lookup_fails(server):
+    server.add_handler('/resource/BoardResource/', lambda target: (500, {}, b'{}'))
+
+    response = main.app.test_client().post('/inspect/board', json={'url': board_url(server)})
+
+    assert response.status_code == 502
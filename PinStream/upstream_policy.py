@@ -0,0 +1,411 @@
+"""Per-host rate limiting, retries, adaptive timeouts and circuit breaking for upstream requests"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+from metrics import Counter
+
+# Opt-in: send upstream requests through the per-host limits below
+UPSTREAM_POLICY = os.environ.get("UPSTREAM_POLICY", "false").lower() in ('1', 'true', 'yes')
+# Requests per second allowed to each host, and how many may go out in a burst
+UPSTREAM_RATE = float(os.environ.get("UPSTREAM_RATE", "20"))
+UPSTREAM_BURST = float(os.environ.get("UPSTREAM_BURST", "40"))
+# Longest a request waits for its host's rate limit before failing instead
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", "2"))
+# Retries per request for timeouts, connection errors, 429 and 502-504
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "2"))
+# Backoff before retry n is uniformly random up to min(BACKOFF_MAX, BACKOFF * 2**n) seconds
+UPSTREAM_BACKOFF = float(os.environ.get("UPSTREAM_BACKOFF", "0.2"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "2"))
+# Retries earned per request sent, process-wide, and the most that can be saved up
+UPSTREAM_RETRY_RATIO = float(os.environ.get("UPSTREAM_RETRY_RATIO", "0.2"))
+UPSTREAM_RETRY_BURST = float(os.environ.get("UPSTREAM_RETRY_BURST", "10"))
+# Timeouts become FACTOR times a host's p99 time to first byte, never under MIN
+# or over the caller's timeout, once SAMPLES responses were seen
+UPSTREAM_TIMEOUT_FACTOR = float(os.environ.get("UPSTREAM_TIMEOUT_FACTOR", "3"))
+UPSTREAM_TIMEOUT_MIN = float(os.environ.get("UPSTREAM_TIMEOUT_MIN", "1"))
+UPSTREAM_TIMEOUT_SAMPLES = int(os.environ.get("UPSTREAM_TIMEOUT_SAMPLES", "20"))
+# Consecutive failures that open a host's circuit, and seconds it stays open
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", "10"))
+
+# Domains whose hosts get limits of their own, one set per domain; every other
+# host (video_url can name any) shares the OTHER_HOSTS set, so the table and
+# its metrics stay bounded
+POLICY_DOMAINS = ('pinterest.com', 'pinterest.co.uk', 'pin.it', 'pinimg.com')
+OTHER_HOSTS = 'other'
+
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+RETRY_METHODS = frozenset(['GET', 'HEAD'])
+
+# Latencies kept per host for the timeout percentile
+LATENCY_WINDOW = 200
+
+UPSTREAM_RETRIES_TOTAL = Counter('pinstream_upstream_retries_total', 'Upstream requests retried, by host and reason',
+                                 ['host', 'reason'])
+UPSTREAM_REJECTED = Counter('pinstream_upstream_rejected_total',
+                            'Upstream requests failed without being sent, by host and reason', ['host', 'reason'])
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """A request refused locally to protect an upstream host"""
+
+
+class RateLimited(UpstreamUnavailable):
+    """The host's rate limit would have made the request wait too long"""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """The host failed repeatedly and is being left alone for a while"""
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average and `burst` at once"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait):
+        """Take a token; return the seconds to wait before using it, or None if that is over max_wait"""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(1.0 - self.tokens, 0.0) / self.rate
+            if wait > max_wait:
+                return None
+            # Tokens go negative while requests queue for them
+            self.tokens -= 1.0
+            return wait
+
+    def drain(self):
+        """Spend every saved-up token, so the host only gets its steady rate"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RetryBudget:
+    """Process-wide allowance of retries, earned as a fraction of requests sent"""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.balance = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.burst, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance < 1.0:
+                return False
+            self.balance -= 1.0
+            return True
+
+
+class LatencyWindow:
+    """Recent time-to-first-byte samples of one host"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._p99 = None
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self._p99 = None
+
+    def p99(self, min_samples):
+        """Return the 99th percentile, or None with fewer than min_samples samples"""
+        with self._lock:
+            if len(self.samples) < max(min_samples, 1):
+                return None
+            if self._p99 is None:
+                ordered = sorted(self.samples)
+                self._p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+            return self._p99
+
+
+class CircuitBreaker:
+    """Closed while a host answers; open for `cooldown` seconds after `threshold` failures in a row.
+
+    After the cooldown one probe request is let through (half open); its
+    outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open':
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                self.state = 'closed'
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                    if self.state == 'closed':
+                        logging.warning("Opening circuit for %s after %s failures", self.name, self.failures)
+                    self.state = 'open'
+                    self.opened_at = time.monotonic()
+                    self.opens += 1
+            self._probing = False
+
+    def release(self):
+        """End a probe whose request failed for reasons unrelated to the host"""
+        with self._lock:
+            self._probing = False
+
+
+class HostPolicy:
+    """Rate limit, circuit and latency history of one upstream host"""
+
+    def __init__(self, policy, name):
+        self.bucket = TokenBucket(policy.rate, policy.burst)
+        self.breaker = CircuitBreaker(name, policy.breaker_failures, policy.breaker_cooldown)
+        self.latency = LatencyWindow()
+
+
+class UpstreamPolicy:
+    """Send upstream requests under per-host rate limits and circuit breakers.
+
+    Timeouts, connection errors, 429 and 502-504 answers to GET and HEAD are
+    retried after a jittered exponential backoff while the shared retry budget
+    lasts. Timeouts shrink to a multiple of the host's observed p99 latency.
+    Hosts are grouped by policy_host(), so Pinterest's domains are limited
+    separately and everything else shares one set of limits.
+    Refused requests raise UpstreamUnavailable, a requests.RequestException.
+    """
+
+    def __init__(self, enabled=UPSTREAM_POLICY, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_wait=UPSTREAM_MAX_WAIT,
+                 retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF, backoff_max=UPSTREAM_BACKOFF_MAX,
+                 retry_ratio=UPSTREAM_RETRY_RATIO, retry_burst=UPSTREAM_RETRY_BURST,
+                 timeout_factor=UPSTREAM_TIMEOUT_FACTOR, timeout_min=UPSTREAM_TIMEOUT_MIN,
+                 timeout_samples=UPSTREAM_TIMEOUT_SAMPLES, breaker_failures=UPSTREAM_BREAKER_FAILURES,
+                 breaker_cooldown=UPSTREAM_BREAKER_COOLDOWN):
+        self.enabled = enabled
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout_factor = timeout_factor
+        self.timeout_min = timeout_min
+        self.timeout_samples = timeout_samples
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.budget = RetryBudget(retry_ratio, retry_burst)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, name):
+        policy = self._hosts.get(name)
+        if policy is None:
+            with self._lock:
+                policy = self._hosts.setdefault(name, HostPolicy(self, name))
+        return policy
+
+    def timeout(self, host, timeout):
+        """Return the timeout to use for host, at most the caller's"""
+        p99 = host.latency.p99(self.timeout_samples)
+        if p99 is None:
+            return timeout
+        return min(timeout, max(self.timeout_min, p99 * self.timeout_factor))
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, or the upstream's Retry-After when it asks for longer"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def send(self, method, url, timeout, send):
+        """Call send(timeout) for url under the host's limits, retrying transient failures"""
+        if not self.enabled:
+            return send(timeout)
+
+        name, host = self._start(url)
+        attempt = 0
+        while True:
+            wait = self._reserve(name, host)
+            if wait:
+                time.sleep(wait)
+            self._admit(name, host)
+
+            try:
+                response = send(self.timeout(host, timeout))
+            except Exception as e:
+                if not self._failed(method, attempt, name, host, e):
+                    raise
+                retry_after = None
+            else:
+                retry, retry_after = self._answered(method, attempt, name, host, response,
+                                                    response.elapsed.total_seconds())
+                if not retry:
+                    return response
+                response.close()
+
+            delay = self.backoff_delay(attempt, retry_after)
+            logging.debug("Retrying %s %s in %.2fs (attempt %s)", method, url, delay, attempt + 1)
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, method, url, timeout, send):
+        """Like send, for a coroutine function send(timeout) returning a streamed httpx response.
+
+        send must raise requests' ConnectionError and Timeout for transport
+        failures, so both paths classify errors alike.
+        """
+        if not self.enabled:
+            return await send(timeout)
+
+        name, host = self._start(url)
+        attempt = 0
+        while True:
+            wait = self._reserve(name, host)
+            if wait:
+                await asyncio.sleep(wait)
+            self._admit(name, host)
+
+            started = time.perf_counter()
+            try:
+                response = await send(self.timeout(host, timeout))
+            except BaseException as e:
+                # Including cancellation, when the client of a download goes away
+                if not self._failed(method, attempt, name, host, e):
+                    raise
+                retry_after = None
+            else:
+                # A streamed httpx response only knows its elapsed time once closed
+                retry, retry_after = self._answered(method, attempt, name, host, response,
+                                                    time.perf_counter() - started)
+                if not retry:
+                    return response
+                await response.aclose()
+
+            delay = self.backoff_delay(attempt, retry_after)
+            logging.debug("Retrying %s %s in %.2fs (attempt %s)", method, url, delay, attempt + 1)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _start(self, url):
+        name = policy_host(url)
+        self.budget.deposit()
+        return name, self.host(name)
+
+    def _reserve(self, name, host):
+        """Return the seconds to wait for a rate token, or raise RateLimited"""
+        wait = host.bucket.reserve(self.max_wait)
+        if wait is None:
+            UPSTREAM_REJECTED.labels(name, 'rate_limited').inc()
+            raise RateLimited(f"Rate limit for {name} would delay the request over {self.max_wait}s")
+        return wait
+
+    def _admit(self, name, host):
+        if not host.breaker.allow():
+            UPSTREAM_REJECTED.labels(name, 'circuit_open').inc()
+            raise CircuitOpen(f"{name} is failing; not sending requests to it for now")
+
+    def _failed(self, method, attempt, name, host, error):
+        """Record a request that raised; return whether to retry it"""
+        if not isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            host.breaker.release()
+            return False
+        host.breaker.record(False)
+        reason = 'timeout' if isinstance(error, requests.Timeout) else 'connection'
+        return self._may_retry(method, attempt, name, reason)
+
+    def _answered(self, method, attempt, name, host, response, seconds):
+        """Record a response that took seconds to arrive; return (retry, Retry-After delay)"""
+        host.latency.observe(seconds)
+        if response.status_code not in RETRY_STATUSES:
+            # Other 4xx answers are about the request, not the host's health
+            host.breaker.record(response.status_code < 500)
+            return False, None
+        if response.status_code == 429:
+            # The host is up but throttling us: slow down rather than trip the circuit
+            host.breaker.release()
+            host.bucket.drain()
+        else:
+            host.breaker.record(False)
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None and retry_after > self.backoff_max:
+            return False, retry_after
+        return self._may_retry(method, attempt, name, str(response.status_code)), retry_after
+
+    def _may_retry(self, method, attempt, name, reason):
+        if method not in RETRY_METHODS or attempt >= self.retries:
+            return False
+        if not self.budget.withdraw():
+            UPSTREAM_REJECTED.labels(name, 'retry_budget').inc()
+            return False
+        UPSTREAM_RETRIES_TOTAL.labels(name, reason).inc()
+        return True
+
+    def stats(self):
+        """Return each host's circuit state, failure count, rate tokens and p99 latency"""
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {
+            name: {
+                'open': 1 if host.breaker.state != 'closed' else 0,
+                'opens': host.breaker.opens,
+                'failures': host.breaker.failures,
+                'tokens': round(host.bucket.tokens, 2),
+                'p99_seconds': host.latency.p99(self.timeout_samples) or 0.0,
+            }
+            for name, host in hosts.items()
+        }
+
+
+def policy_host(url):
+    """Return the name url's limits are kept under: its Pinterest domain, or OTHER_HOSTS"""
+    host = (urlsplit(url).hostname or '').lower()
+    for domain in POLICY_DOMAINS:
+        if host == domain or host.endswith('.' + domain):
+            return domain
+    return OTHER_HOSTS
+
+
+def parse_retry_after(value):
+    """Return a Retry-After header's delay in seconds, or None if absent or an HTTP date"""
+    if value and value.strip().isdigit():
+        return float(value.strip())
+    return None
@@ -0,0 +1,266 @@
+"""On-disk cache of downloaded video bodies, keyed by normalized video URL"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+# Directory holding cached videos; unset disables the cache
+VIDEO_CACHE_DIR = os.environ.get("VIDEO_CACHE_DIR", "")
+# Total bytes kept on disk before least recently used videos are evicted
+VIDEO_CACHE_MAX_BYTES = int(os.environ.get("VIDEO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Videos larger than this are streamed but never cached
+VIDEO_CACHE_MAX_FILE_BYTES = int(os.environ.get("VIDEO_CACHE_MAX_FILE_BYTES", str(256 * 1024 ** 2)))
+
+# Seconds after its last write that a partial file counts as left by a crashed worker;
+# a live fill writes with every chunk it streams
+VIDEO_CACHE_PARTIAL_TTL = float(os.environ.get("VIDEO_CACHE_PARTIAL_TTL", "600"))
+
+VIDEO_SUFFIX = '.mp4'
+META_SUFFIX = '.json'
+PARTIAL_SUFFIX = '.part'
+
+# Upstream headers stored alongside each video and sent with cache hits
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def normalize_video_url(url):
+    """Lower-case the scheme and host and drop the fragment, so equivalent URLs share an entry"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+class CachedVideo:
+    """A complete cached video file and the upstream headers it was stored with"""
+
+    def __init__(self, path, size, headers):
+        self.path = path
+        self.size = size
+        self.headers = headers
+
+
+class CacheWriter:
+    """A body being written to the cache.
+
+    close() commits the entry only if exactly length bytes were written; an
+    aborted stream or a write error leaves the cache untouched.
+    """
+
+    def __init__(self, cache, url, length, headers, partial_path, file):
+        self.cache = cache
+        self.url = url
+        self.length = length
+        self.headers = headers
+        self.partial_path = partial_path
+        self.file = file
+        self.written = 0
+        self.writable = True
+
+    def write(self, chunk):
+        if self.writable:
+            try:
+                self.file.write(chunk)
+            except OSError as e:
+                logging.warning("Video cache write error: %s", e)
+                self.writable = False
+        self.written += len(chunk)
+
+    def close(self):
+        try:
+            self.file.close()
+        except OSError as e:
+            logging.warning("Video cache write error: %s", e)
+            self.writable = False
+        if self.writable and self.written == self.length:
+            self.cache._commit(self.url, self.partial_path, self.written, self.headers)
+        else:
+            _remove(self.partial_path)
+
+
+class VideoCache:
+    """Disk LRU of video bodies, filled while they stream to the client.
+
+    Files are written under a temporary name and renamed into place only once
+    the full upstream length has arrived, so a partial body is never served.
+    Recency is the file atime, set on every hit, which lets all worker
+    processes share one directory.
+    """
+
+    def __init__(self, directory=VIDEO_CACHE_DIR, max_bytes=VIDEO_CACHE_MAX_BYTES,
+                 max_file_bytes=VIDEO_CACHE_MAX_FILE_BYTES, partial_ttl=VIDEO_CACHE_PARTIAL_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.partial_ttl = partial_ttl
+        self._lock = threading.Lock()
+        # Bytes this process believes are on disk; corrected by each eviction scan
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def _paths(self, url):
+        key = hashlib.sha256(normalize_video_url(url).encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + VIDEO_SUFFIX, base + META_SUFFIX
+
+    def get(self, url):
+        """Return the CachedVideo for url, or None"""
+        if not self.enabled:
+            return None
+        video_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            stat = os.stat(video_path)
+            size = stat.st_size
+            if size != meta.get('size'):
+                raise ValueError('size mismatch')
+            # Recency lives in atime so the mtime, and validators built from it, stay put
+            os.utime(video_path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.debug("Video cache entry unreadable for %s: %s", url, e)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return CachedVideo(video_path, size, meta.get('headers', {}))
+
+    def contains(self, url):
+        """Like get, but a miss is not counted and recency is not refreshed; for checks that serve nothing"""
+        if not self.enabled:
+            return False
+        video_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            return os.stat(video_path).st_size == meta.get('size')
+        except (OSError, ValueError):
+            return False
+
+    def can_store(self, length):
+        return self.enabled and length is not None and 0 < length <= self.max_file_bytes
+
+    def open_writer(self, url, length, headers):
+        """Return a CacheWriter for a body of length bytes, or None if the cache cannot take it"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix=PARTIAL_SUFFIX)
+        except OSError as e:
+            logging.warning("Video cache unavailable, streaming without it: %s", e)
+            return None
+        stored = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        return CacheWriter(self, url, length, stored, partial_path, os.fdopen(fd, 'wb'))
+
+    def tee(self, url, length, headers, chunks):
+        """Yield chunks unchanged while writing them to the cache"""
+        writer = self.open_writer(url, length, headers)
+        if writer is None:
+            yield from chunks
+            return
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+            writer.close()
+
+    def _commit(self, url, partial_path, size, headers):
+        video_path, meta_path = self._paths(url)
+        try:
+            os.makedirs(os.path.dirname(video_path), exist_ok=True)
+            # Metadata first: a video file is only served once its metadata exists
+            fd, meta_partial = tempfile.mkstemp(dir=self.directory, suffix=PARTIAL_SUFFIX)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'size': size, 'headers': headers}, f)
+            os.replace(meta_partial, meta_path)
+            os.replace(partial_path, video_path)
+        except OSError as e:
+            logging.warning("Video cache commit failed for %s: %s", url, e)
+            _remove(partial_path)
+            return
+        logging.debug("Cached %s byte video for %s", size, url)
+        with self._lock:
+            self.fills += 1
+            if self._size is not None:
+                self._size += size
+            over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Delete stale partial files, then least recently used videos until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        stale_before = time.time() - self.partial_ttl
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if not name.endswith((VIDEO_SUFFIX, PARTIAL_SUFFIX)):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(PARTIAL_SUFFIX):
+                    # Fills in progress take disk too; ones no longer written were left by a dead worker
+                    if stat.st_mtime < stale_before:
+                        _remove(path)
+                    else:
+                        total += stat.st_size
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total += stat.st_size
+
+        evicted = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                # A worker still sending this file keeps its open descriptor
+                _remove(path)
+                _remove(path[:-len(VIDEO_SUFFIX)] + META_SUFFIX)
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+
+    def clear(self):
+        with self._lock:
+            self._size = None
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                _remove(os.path.join(dirpath, name))
+
+    def stats(self):
+        """Return hit/miss/fill counters and the bytes this process last saw on disk"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'fills': self.fills,
+                'evictions': self.evictions,
+                'bytes': self._size or 0,
+            }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.debug("Could not remove %s: %s", path, e)
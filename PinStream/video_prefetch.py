@@ -0,0 +1,269 @@
+"""Background fetching of the leading bytes of videos found by /inspect, ahead of their download"""
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+from downloads import iter_upstream
+from http_client import DOWNLOAD_TIMEOUT
+from segmented_fetch import SegmentError, parse_content_range
+from video_cache import normalize_video_url
+
+# Opt-in: prefetch the start of every video an inspection finds
+VIDEO_PREFETCH = os.environ.get("VIDEO_PREFETCH", "false").lower() in ('1', 'true', 'yes')
+# Leading bytes fetched per video
+PREFETCH_BYTES = int(os.environ.get("PREFETCH_BYTES", str(1024 ** 2)))
+# Most bytes kept per video, when a moov atom at the front runs past PREFETCH_BYTES
+PREFETCH_MAX_BYTES = int(os.environ.get("PREFETCH_MAX_BYTES", str(4 * 1024 ** 2)))
+# Prefetches in flight at once; inspections beyond that are not prefetched
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "4"))
+# Bytes held by prefetched and in-flight videos; the oldest are dropped to make room
+PREFETCH_MEMORY_BYTES = int(os.environ.get("PREFETCH_MEMORY_BYTES", str(64 * 1024 ** 2)))
+# Seconds a prefetched video waits for its download
+PREFETCH_TTL = float(os.environ.get("PREFETCH_TTL", "60"))
+
+
+def front_moov_end(data):
+    """Return where the moov atom ends if it precedes the media data, else None"""
+    offset = 0
+    while offset + 8 <= len(data):
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        if size == 1:
+            if offset + 16 > len(data):
+                return None
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+        if kind == b'moov':
+            return offset + size
+        if kind == b'mdat' or size < 8:
+            return None
+        offset += size
+    return None
+
+
+class PrefetchedVideo:
+    """The leading bytes of an upstream video, streamed out ahead of the rest"""
+
+    def __init__(self, prefetcher, url, data, length, headers):
+        self.prefetcher = prefetcher
+        self.url = url
+        self.data = data
+        self.length = length
+        self.headers = headers
+        self.expires = time.monotonic() + prefetcher.ttl
+
+    @property
+    def response_headers(self):
+        return {name: self.headers[name] for name in ('ETag', 'Last-Modified') if name in self.headers}
+
+    def remainder_headers(self):
+        """Request headers for the bytes after the prefetched ones"""
+        return self.prefetcher.range_headers(len(self.data), self.length - 1, self.headers.get('ETag'))
+
+    def check_remainder(self, status, headers):
+        """Raise SegmentError unless an upstream response carries exactly the remaining bytes"""
+        content_range = parse_content_range(headers.get('Content-Range'))
+        if (status != 206 or content_range != (len(self.data), self.length - 1, self.length)
+                or 'Content-Encoding' in headers):
+            # Most likely the video changed since it was prefetched
+            raise SegmentError(f"expected bytes {len(self.data)}-{self.length - 1}/{self.length}, got "
+                               f"{status} {headers.get('Content-Range')}")
+
+    def open_remainder(self):
+        """Request the bytes after the prefetched ones; return the streamed 206 response"""
+        response = http_client.get(self.url, headers=self.remainder_headers(), stream=True, timeout=DOWNLOAD_TIMEOUT)
+        try:
+            self.check_remainder(response.status_code, response.headers)
+        except SegmentError:
+            response.close()
+            raise
+        return response
+
+    def iter_chunks(self, chunk_size):
+        remainder = None
+        if len(self.data) < self.length:
+            # Under way while the prefetched bytes go out
+            remainder = self.prefetcher.get_executor().submit(self.open_remainder)
+        try:
+            view = memoryview(self.data)
+            for offset in range(0, len(self.data), chunk_size):
+                yield bytes(view[offset:offset + chunk_size])
+            if remainder is not None:
+                yield from iter_upstream(remainder.result(), chunk_size)
+        finally:
+            if remainder is not None and not remainder.cancel():
+                # Release the remainder's connection even if it was never read
+                remainder.add_done_callback(_close_response)
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class VideoPrefetcher:
+    """Fetch the first bytes of videos in the background, held briefly for their download.
+
+    The range requests also leave a warm pooled connection to the CDN. At most
+    `concurrency` prefetches run at once and at most `budget` bytes are held;
+    a video is handed out once, by take().
+    """
+
+    def __init__(self, headers=None, enabled=VIDEO_PREFETCH, prefix_bytes=PREFETCH_BYTES,
+                 max_bytes=PREFETCH_MAX_BYTES, concurrency=PREFETCH_CONCURRENCY,
+                 budget=PREFETCH_MEMORY_BYTES, ttl=PREFETCH_TTL):
+        self.headers = headers or {}
+        self.enabled = enabled
+        self.prefix_bytes = prefix_bytes
+        self.max_bytes = max(max_bytes, prefix_bytes)
+        self.concurrency = concurrency
+        self.budget = budget
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._in_flight = set()
+        self._held = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.skipped = 0
+        self.failed = 0
+        self.unrangeable = 0
+        self.expired = 0
+
+    def get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Room for remainder requests next to the prefetches themselves
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency * 2,
+                                                        thread_name_prefix='prefetch')
+        return self._executor
+
+    def after_fork(self):
+        """Forget a parent process's thread pool, whose threads do not exist in a forked child"""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def schedule(self, url):
+        """Start prefetching url unless it is held, in flight, or over the limits; return whether it started"""
+        if not self.enabled:
+            return False
+        key = normalize_video_url(url)
+        with self._lock:
+            self._expire()
+            if key in self._entries or key in self._in_flight:
+                return False
+            if len(self._in_flight) >= self.concurrency or not self._reserve(self.max_bytes):
+                self.skipped += 1
+                return False
+            self._in_flight.add(key)
+        self.get_executor().submit(self._prefetch, key, url)
+        return True
+
+    def take(self, url):
+        """Return and forget the prefetched video for url, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._expire()
+            video = self._entries.pop(normalize_video_url(url), None)
+            if video is None:
+                self.misses += 1
+                return None
+            self._held -= len(video.data)
+            self.hits += 1
+            return video
+
+    def _reserve(self, size):
+        # Drop the oldest prefetched videos until size fits the budget
+        while self._held + size > self.budget and self._entries:
+            _, video = self._entries.popitem(last=False)
+            self._held -= len(video.data)
+        if self._held + size > self.budget:
+            return False
+        self._held += size
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            key, video = next(iter(self._entries.items()))
+            if video.expires > now:
+                break
+            del self._entries[key]
+            self._held -= len(video.data)
+            self.expired += 1
+
+    def _prefetch(self, key, url):
+        video = None
+        try:
+            video = self._fetch(url)
+        except (requests.RequestException, SegmentError) as e:
+            logging.debug("Prefetch of %s failed: %s", url, e)
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+                self._held -= self.max_bytes
+                if video is not None:
+                    self._entries[key] = video
+                    self._held += len(video.data)
+                    self.stored += 1
+
+    def range_headers(self, first, last, etag=None):
+        headers = dict(self.headers, **{'Accept-Encoding': 'identity', 'Range': f'bytes={first}-{last}'})
+        if etag and not etag.startswith('W/'):
+            # A changed video answers 200 instead of mixing versions
+            headers['If-Range'] = etag
+        return headers
+
+    def _fetch(self, url):
+        """Fetch the leading bytes of url, extended to the end of a front moov atom; None if unrangeable"""
+        response = http_client.get(url, headers=self.range_headers(0, self.prefix_bytes - 1), stream=True,
+                                   timeout=DOWNLOAD_TIMEOUT)
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        if (response.status_code != 206 or content_range is None or content_range[0] != 0
+                or content_range[2] is None or 'Content-Encoding' in response.headers):
+            response.close()
+            with self._lock:
+                self.unrangeable += 1
+            return None
+        # Read in full, so the warm connection goes back to the pool
+        data = response.content
+        length = content_range[2]
+        if len(data) != content_range[1] + 1:
+            raise SegmentError(f"short prefetch: {len(data)} bytes for {content_range}")
+
+        headers = {name: response.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified')
+                   if name in response.headers}
+        moov_end = front_moov_end(data)
+        if moov_end is not None and len(data) < moov_end <= min(self.max_bytes, length):
+            more = http_client.get(url, headers=self.range_headers(len(data), moov_end - 1, headers.get('ETag')),
+                                   timeout=DOWNLOAD_TIMEOUT)
+            if (more.status_code == 206 and parse_content_range(more.headers.get('Content-Range'))
+                    == (len(data), moov_end - 1, length) and len(more.content) == moov_end - len(data)):
+                data += more.content
+        return PrefetchedVideo(self, url, data, length, headers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._held,
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stored': self.stored,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'unrangeable': self.unrangeable,
+                'expired': self.expired,
+            }
@@ -0,0 +1,192 @@
+"""Single-pass, precompiled video URL scanning for Pinterest pin pages"""
+import re
+from collections import namedtuple
+
+# A rule is one regex in the combined scanner. Each grade maps a hit of that
+# regex onto a (tier, rank); lower ranks win within a tier. A grade with a
+# needle only applies when the needle appears before the URL's last ".mp4"
+# ("{pin_id}" is substituted with the pin being scanned).
+Rule = namedtuple('Rule', ['pattern', 'grades'])
+Grade = namedtuple('Grade', ['tier', 'rank', 'needle'])
+Grade.__new__.__defaults__ = (None,)
+
+PIN_ID_NEEDLE = '{pin_id}'
+
+
+def clean_escaped_url(video_url):
+    """Undo the JSON escaping Pinterest applies to URLs embedded in scripts"""
+    return video_url.replace('\\u002F', '/').replace('\\', '')
+
+
+class ScanResult:
+    """Per-tier best hits for one document, computed on first access"""
+
+    def __init__(self, scanner, text, pin_id):
+        self._scanner = scanner
+        self._text = text
+        self._pin_id = pin_id
+        self._hits = None
+
+    def first(self, tier):
+        """Return the best-ranked URL found for a tier, or None"""
+        if self._hits is None:
+            self._hits = self._scanner._walk(self._text, self._pin_id)
+            self._text = None
+        hit = self._hits.get(tier)
+        return hit[1] if hit else None
+
+
+class VideoScanner:
+    """Match a prioritised set of video URL patterns in one walk over a document.
+
+    All rules are compiled once into a single alternation, so the document is
+    read a single time instead of once per pattern. For every tier the result
+    is the same URL that running that tier's patterns one after another with
+    ``re.findall`` and taking the first acceptable match would return. The walk
+    stops early once a hit of the best rank of the first tier is seen.
+
+    When every rule is confined to a single double-quoted run containing the
+    ``anchor`` text, only the neighbourhood of each anchor is searched: from
+    ``reach`` characters before the preceding quote up to the next quote.
+    """
+
+    def __init__(self, tiers, rules, flags=re.IGNORECASE, anchor=None, reach=0):
+        self.tiers = [name for name, _ in tiers]
+        self._accept = dict(tiers)
+        self._rules = rules
+        self._compiled = [re.compile(rule.pattern, flags) for rule in rules]
+        alternatives = '|'.join(f'(?P<r{i}>{rule.pattern})' for i, rule in enumerate(rules))
+        self._combined = re.compile(alternatives, flags)
+        self._anchor = re.compile(anchor, flags) if anchor else None
+        self._reach = reach
+        self._top_tier = self.tiers[0]
+        self._top_rank = min(g.rank for rule in rules for g in rule.grades if g.tier == self._top_tier)
+
+    def scan(self, text, pin_id=None):
+        """Prepare a lazy scan of text; the walk runs when a tier is first read"""
+        return ScanResult(self, text, pin_id)
+
+    def _walk(self, text, pin_id):
+        hits = {}
+        pin_needle = str(pin_id).lower()
+        # Where a findall of each rule on its own would resume matching
+        resume = [0] * len(self._rules)
+        search = self._combined.search
+        pos = 0
+        for low, high in self._windows(text):
+            pos = max(pos, low)
+            while True:
+                match = search(text, pos, high)
+                if not match:
+                    break
+                start = match.start()
+                pos = start + 1
+                # The alternation reports only the first rule matching here,
+                # but the later ones would have matched here as well in their
+                # own findall pass
+                for index in range(int(match.lastgroup[1:]), len(self._rules)):
+                    if start < resume[index]:
+                        continue
+                    rule_match = self._compiled[index].match(text, start)
+                    if not rule_match:
+                        continue
+                    resume[index] = max(rule_match.end(), start + 1)
+                    value = rule_match.group(1) if rule_match.re.groups else rule_match.group(0)
+                    self._grade(self._rules[index], value, pin_needle, hits)
+
+                top = hits.get(self._top_tier)
+                if top and top[0] == self._top_rank:
+                    return hits
+        return hits
+
+    def _windows(self, text):
+        """Yield the (start, end) spans of text that can hold a match"""
+        if self._anchor is None:
+            yield 0, len(text)
+            return
+        pos = 0
+        while True:
+            anchor = self._anchor.search(text, pos)
+            if not anchor:
+                return
+            low = max(text.rfind('"', 0, anchor.start()) - self._reach, 0)
+            high = text.find('"', anchor.end())
+            high = len(text) if high == -1 else high + 1
+            yield low, high
+            pos = high
+
+    def _grade(self, rule, value, pin_needle, hits):
+        graded = set()
+        for grade in rule.grades:
+            if grade.tier in graded:
+                continue
+            best = hits.get(grade.tier)
+            if best and best[0] <= grade.rank:
+                graded.add(grade.tier)
+                continue
+            if grade.needle is not None:
+                needle = pin_needle if grade.needle == PIN_ID_NEEDLE else grade.needle
+                lowered = value.lower()
+                found = lowered.find(needle)
+                if found == -1 or lowered.rfind('.mp4') < found + len(needle):
+                    continue
+            video_url = self._accept[grade.tier](value)
+            if video_url:
+                hits[grade.tier] = (grade.rank, video_url)
+                graded.add(grade.tier)
+
+
+def _accept_api(match):
+    if len(match) > 20:
+        video_url = clean_escaped_url(match)
+        if 'http' in video_url:
+            return video_url
+    return None
+
+
+def _accept_cdn(match):
+    return match if len(match) > 20 else None
+
+
+def _accept_script(match):
+    lowered = match.lower()
+    if 'video' in lowered or any(ext in lowered for ext in ['.mp4', '.webm', '.mov']):
+        return match
+    return None
+
+
+# Whole-page scanner. The "api" tier mirrors find_video_in_api_calls, the
+# "cdn" tier mirrors the Pinterest CDN fallback in extract_pinterest_metadata.
+PAGE_SCANNER = VideoScanner(
+    tiers=[('api', _accept_api), ('cdn', _accept_cdn)],
+    rules=[
+        Rule(r'https://v1\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*',
+             [Grade('api', 0, PIN_ID_NEEDLE), Grade('api', 1), Grade('cdn', 0)]),
+        Rule(r'https://i\.pinimg\.com/videos/[^"\']+\.mp4[^"\']*',
+             [Grade('api', 2), Grade('cdn', 1)]),
+        Rule(r'https://v\d*\.pinimg\.com/[^"\']*\.mp4[^"\']*',
+             [Grade('api', 3), Grade('cdn', 2)]),
+        Rule(r'"video_url":"([^"]+\.mp4[^"]*)"', [Grade('api', 4)]),
+        Rule(r'"contentUrl":"([^"]+\.mp4[^"]*)"', [Grade('api', 5)]),
+        Rule(r'"embedUrl":"([^"]+\.mp4[^"]*)"', [Grade('api', 6)]),
+        Rule(r'https://[^"\']*\.mp4[^"\']*',
+             [Grade('cdn', 3, 'pinterest'), Grade('cdn', 4, PIN_ID_NEEDLE)]),
+    ],
+    anchor=r'\.mp4',
+    reach=len('"contentUrl":'),
+)
+
+# Per-<script> scanner for the script tag fallback. A quoted ".mp4" URL that
+# also contains "video" is always matched by the plain ".mp4" rule first, so
+# it needs no rule of its own.
+SCRIPT_SCANNER = VideoScanner(
+    tiers=[('script', _accept_script)],
+    rules=[
+        Rule(r'"(https?://[^"]*\.mp4[^"]*)"', [Grade('script', 0)]),
+        Rule(r'"(https?://[^"]*\.webm[^"]*)"', [Grade('script', 1)]),
+        Rule(r'"(https?://[^"]*\.mov[^"]*)"', [Grade('script', 2)]),
+        Rule(r'"videoUrl":"([^"]+)"', [Grade('script', 4)]),
+        Rule(r'"contentUrl":"([^"]+)"', [Grade('script', 5)]),
+        Rule(r'"video_url":"([^"]+)"', [Grade('script', 6)]),
+    ],
+)